@@ -0,0 +1,316 @@
+import re
+
+# The one reference table for lab values, shared by the NER evaluation and the
+# LLM analyzer. "aliases" are extra names the scanner and the reference index
+# accept; "convert" maps other units of the same analyte onto "unit".
+# "raw_scale" undoes counts written out in full ("7,500" WBC) when no unit is given.
+ANALYTES = {
+    "Alanine aminotransferase (ALT)": {
+        "range": (10, 40), "unit": "U/L",
+        "aliases": ("SGPT", "alanine transaminase"),
+    },
+    "Albumin": {
+        "range": (3.5, 5), "unit": "g/dL",
+        "aliases": ("serum albumin",),
+    },
+    "Potassium": {
+        "range": (3.5, 5.0), "unit": "mEq/L",
+        "aliases": ("serum potassium",), "convert": {"mmol/L": 1.0},
+    },
+    "Sodium": {
+        "range": (136, 142), "unit": "mEq/L",
+        "aliases": ("serum sodium",), "convert": {"mmol/L": 1.0},
+    },
+    "Hemoglobin": {
+        "range": (12, 18), "unit": "g/dL",
+        "aliases": ("haemoglobin", "HGB", "Hb"), "convert": {"mmol/L": 1.611},
+    },
+    "Glucose": {
+        "range": (70, 110), "unit": "mg/dL",
+        "aliases": ("blood glucose", "plasma glucose", "serum glucose", "random glucose"),
+        "convert": {"mmol/L": 18.016},
+    },
+    "White Blood Cell (WBC)": {
+        "range": (4.5, 11.0), "unit": "K/µL",
+        "aliases": (
+            "white blood cells", "white blood cell count", "white cell count", "WBC count",
+            "leukocytes", "leukocyte count",
+        ),
+        "raw_scale": 1e3,
+    },
+    "Red Blood Cell (RBC)": {
+        "range": (4.5, 5.9), "unit": "M/µL",
+        "aliases": (
+            "red blood cells", "red blood cell count", "red cell count", "RBC count",
+            "erythrocytes", "erythrocyte count",
+        ),
+        "raw_scale": 1e6,
+    },
+    "Platelet Count": {
+        "range": (150, 450), "unit": "K/µL",
+        "aliases": ("platelets", "platelet", "PLT", "thrombocytes"),
+        "raw_scale": 1e3,
+    },
+    "Total Cholesterol": {
+        "range": (125, 200), "unit": "mg/dL",
+        "aliases": ("cholesterol", "cholesterol total", "serum cholesterol"),
+        "convert": {"mmol/L": 38.67},
+    },
+    "HDL Cholesterol": {
+        "range": (40, 60), "unit": "mg/dL",
+        "aliases": ("HDL", "HDL-C", "HDL cholesterol direct"), "convert": {"mmol/L": 38.67},
+    },
+    "LDL Cholesterol": {
+        "range": (0, 100), "unit": "mg/dL",
+        "aliases": ("LDL", "LDL-C", "LDL cholesterol calculated"), "convert": {"mmol/L": 38.67},
+    },
+    "Triglycerides": {
+        "range": (0, 150), "unit": "mg/dL",
+        "aliases": ("triglyceride",), "convert": {"mmol/L": 88.57},
+    },
+    "Creatinine": {
+        "range": (0.6, 1.2), "unit": "mg/dL",
+        "aliases": ("serum creatinine",), "convert": {"µmol/L": 1 / 88.42},
+    },
+    "BUN (Blood Urea Nitrogen)": {
+        "range": (7, 20), "unit": "mg/dL",
+        "aliases": ("urea nitrogen",), "convert": {"mmol/L": 2.801},
+    },
+    "AST (Aspartate Aminotransferase)": {
+        "range": (10, 40), "unit": "U/L",
+        "aliases": ("SGOT", "aspartate transaminase"),
+    },
+    "Alkaline Phosphatase": {
+        "range": (44, 147), "unit": "U/L",
+        "aliases": ("ALP", "alk phos"),
+    },
+    "Total Bilirubin": {
+        "range": (0.3, 1.2), "unit": "mg/dL",
+        "aliases": ("bilirubin", "bilirubin total"), "convert": {"µmol/L": 1 / 17.1},
+    },
+    "TSH (Thyroid Stimulating Hormone)": {
+        "range": (0.4, 4.0), "unit": "mIU/L",
+        "aliases": ("thyrotropin",),
+    },
+    "T4 (Thyroxine)": {
+        "range": (4.5, 11.2), "unit": "µg/dL",
+        "aliases": ("total T4", "T4 total"), "convert": {"nmol/L": 1 / 12.87},
+    },
+    "HbA1c (Hemoglobin A1c)": {
+        "range": (4.0, 5.6), "unit": "%",
+        "aliases": ("haemoglobin A1c", "A1c", "glycated hemoglobin", "glycosylated hemoglobin"),
+    },
+    "Fasting Blood Sugar": {
+        "range": (70, 100), "unit": "mg/dL",
+        "aliases": (
+            "FBS", "fasting glucose", "glucose fasting", "fasting blood glucose", "fasting plasma glucose",
+        ),
+        "convert": {"mmol/L": 18.016},
+    },
+    "Calcium": {
+        "range": (8.5, 10.5), "unit": "mg/dL",
+        "aliases": ("total calcium", "serum calcium"), "convert": {"mmol/L": 4.008},
+    },
+    "Magnesium": {
+        "range": (1.7, 2.2), "unit": "mg/dL",
+        "aliases": ("serum magnesium",), "convert": {"mmol/L": 2.431},
+    },
+    "Chloride": {
+        "range": (96, 106), "unit": "mEq/L",
+        "aliases": ("serum chloride",), "convert": {"mmol/L": 1.0},
+    },
+}
+
+# Names that contain an analyte's name but measure something else; the scanner
+# matches them so the longer name wins, then drops the reading
+IGNORED_NAMES = (
+    "mean corpuscular hemoglobin", "mean corpuscular hemoglobin concentration", "MCH", "MCHC",
+    "estimated average glucose", "urine glucose", "glucose tolerance",
+    "non-HDL", "non-HDL cholesterol", "cholesterol/HDL ratio", "total cholesterol/HDL ratio",
+    "LDL/HDL ratio", "direct bilirubin", "indirect bilirubin", "bilirubin direct",
+    "bilirubin indirect", "free T4", "urine creatinine", "creatinine clearance",
+    "ionized calcium", "calcium ionized",
+)
+
+# Spellings of the same unit, keyed by normalize_unit's lookup form
+UNIT_SPELLINGS = {
+    "%": "%",
+    "g/dl": "g/dL",
+    "g/l": "g/L",
+    "mg/dl": "mg/dL",
+    "mmol/l": "mmol/L",
+    "µmol/l": "µmol/L",
+    "nmol/l": "nmol/L",
+    "meq/l": "mEq/L",
+    "u/l": "U/L",
+    "iu/l": "U/L",
+    "miu/l": "mIU/L",
+    "µiu/ml": "mIU/L",
+    "µg/dl": "µg/dL",
+    "mmol/mol": "mmol/mol",
+    "k/µl": "K/µL",
+    "thou/µl": "K/µL",
+    "10^3/µl": "K/µL",
+    "10^3/mm^3": "K/µL",
+    "10^9/l": "K/µL",
+    "m/µl": "M/µL",
+    "mil/µl": "M/µL",
+    "million/µl": "M/µL",
+    "10^6/µl": "M/µL",
+    "10^6/mm^3": "M/µL",
+    "10^12/l": "M/µL",
+    "/µl": "/µL",
+    "cells/µl": "/µL",
+    "/mm^3": "/µL",
+    "cells/mm^3": "/µL",
+}
+
+# Conversions that hold for any analyte: factor to multiply by
+UNIT_CONVERSIONS = {
+    ("/µL", "K/µL"): 1e-3,
+    ("/µL", "M/µL"): 1e-6,
+    ("g/L", "g/dL"): 0.1,
+}
+
+def normalize_unit(unit):
+    """Canonical spelling of a unit ("x10^3/uL" -> "K/µL"), or None if it isn't known"""
+    key = re.sub(r"\s+", "", unit).lower().replace("μ", "µ")
+    key = key.replace("³", "^3").replace("⁶", "^6").replace("⁹", "^9").replace("*", "^")
+    key = re.sub(r"\b(?:u|mc)(?=g|l\b|mol|iu)", "µ", key)
+    key = re.sub(r"^x(?=10)", "", key).replace("mm3", "mm^3")
+    return UNIT_SPELLINGS.get(key)
+
+def unit_factor(analyte, unit):
+    """Factor converting ``unit`` to the analyte's reference unit, or None"""
+    info = ANALYTES[analyte]
+    if unit == info["unit"]:
+        return 1.0
+    if unit in info.get("convert", {}):
+        return info["convert"][unit]
+    return UNIT_CONVERSIONS.get((unit, info["unit"]))
+
+def _names(analyte):
+    names = [re.sub(r"\s*\([^)]*\)", "", analyte)]
+    names += re.findall(r"\(([^)]+)\)", analyte)
+    return names + list(ANALYTES[analyte].get("aliases", ()))
+
+def _name_key(name):
+    return re.sub(r"[\s\-,]+", " ", name.lower()).strip()
+
+def reference_ranges():
+    return {name: {"range": info["range"], "unit": info["unit"]} for name, info in ANALYTES.items()}
+
+def reference_aliases():
+    """Alias -> analyte, for the reference index"""
+    return {alias: name for name, info in ANALYTES.items() for alias in info.get("aliases", ())}
+
+def _trie_pattern(words):
+    """Regex alternation of ``words`` as a trie, so each position follows one branch"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node):
+        branches = [
+            (r"[\s\-,]+" if char == " " else re.escape(char)) + emit(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A word ending here makes the rest optional; greedy, so longer names win
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return emit(trie)
+
+UNIT_PATTERN = (
+    r"%|(?:x\s*)?10\s*[\^*]?\s*(?:3|6|9|12|[³⁶⁹])\s*/\s*(?:[µμu]?l|mm[3³])"
+    r"|[a-zµμ]{0,8}\s*/\s*[a-zµμ]{1,4}[3³]?"
+)
+
+class LabScanner:
+    """Finds every analyte / value / unit reading in one pass over the text.
+
+    All analyte names are compiled into a single trie-shaped regex with the
+    value and optional unit after it, so the text is scanned once no matter
+    how many analytes the catalog holds. Values come back in each analyte's
+    reference unit; readings whose unit can't be converted are dropped.
+    """
+
+    def __init__(self, analytes=ANALYTES, ignored=IGNORED_NAMES):
+        self._analyte_for = {}
+        for name in analytes:
+            for alias in _names(name):
+                self._analyte_for.setdefault(_name_key(alias), name)
+        for alias in ignored:
+            self._analyte_for[_name_key(alias)] = None
+
+        self.pattern = re.compile(
+            r"\b(?P<name>" + _trie_pattern(sorted(self._analyte_for)) + r")\b"
+            r"[^\d\n]{0,40}?"
+            # A whole number only, never digits inside a name such as "A1c"
+            r"(?<![\w.])(?P<value>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+            r"(?:[^\S\n]*(?P<unit>" + UNIT_PATTERN + r")(?!\w))?",
+            re.IGNORECASE
+        )
+
+    def _reading(self, match):
+        analyte = self._analyte_for.get(_name_key(match.group("name")))
+        if analyte is None:
+            return None
+        info = ANALYTES[analyte]
+        value = float(match.group("value").replace(",", ""))
+
+        raw_unit = match.group("unit")
+        if raw_unit:
+            factor = unit_factor(analyte, normalize_unit(raw_unit))
+            if factor is None:
+                return None
+            value *= factor
+        elif "raw_scale" in info and value > info["range"][1] * 10:
+            value /= info["raw_scale"]
+
+        return {
+            "analyte": analyte,
+            "name": match.group("name"),
+            "value": round(value, 6),
+            "unit": info["unit"],
+            "raw_value": match.group("value"),
+            "raw_unit": raw_unit,
+            "start": match.start(),
+            "end": match.end(),
+        }
+
+    def scan(self, text):
+        readings = []
+        for match in self.pattern.finditer(text):
+            reading = self._reading(match)
+            if reading is not None:
+                readings.append(reading)
+        return readings
+
+def classify(reading):
+    low, high = ANALYTES[reading["analyte"]]["range"]
+    if reading["value"] < low:
+        return "low"
+    if reading["value"] > high:
+        return "high"
+    return "normal"
+
+def readings_to_entities(readings):
+    """Readings in the NER pipeline's entity format, so the rest of the pipeline is unchanged"""
+    entities = []
+    for reading in readings:
+        start, end = reading["start"], reading["end"]
+        for group, word in (
+            ("Diagnostic_procedure", reading["name"]),
+            ("Lab_value", f"{reading['value']:g}"),
+            ("Unit", reading["unit"]),
+        ):
+            entities.append({"entity_group": group, "word": word, "score": 1.0, "start": start, "end": end})
+    return entities
+
+scanner = LabScanner()
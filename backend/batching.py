@@ -0,0 +1,92 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import BATCHER_QUEUE_DEPTH
+
+
+class MicroBatcher:
+    """Collects inputs from concurrent callers and runs them as one batch.
+
+    ``run_batch`` receives a list of inputs and must return a list of outputs
+    in the same order. Callers block in ``run`` until their own outputs are
+    ready, so many in-flight requests share a single padded forward pass.
+    """
+
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=10):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._owner_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, run_batch):
+        return cls(
+            run_batch,
+            max_batch_size=int(os.environ.get("NER_MAX_BATCH_SIZE", "16")),
+            max_wait_ms=float(os.environ.get("NER_MAX_WAIT_MS", "10")),
+        )
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so a forked worker starts its own
+        if self._worker is not None and self._owner_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._owner_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._owner_pid = os.getpid()
+                self._worker = threading.Thread(
+                    target=self._loop, name="ner-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def submit(self, item):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        BATCHER_QUEUE_DEPTH.set(self._queue.qsize())
+        return future
+
+    def run(self, items):
+        """Submit every item and wait for all outputs, preserving order"""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        BATCHER_QUEUE_DEPTH.set(self._queue.qsize())
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            batch = [(item, future) for item, future in batch
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outputs = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
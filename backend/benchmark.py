@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import time
+
+import numpy as np
+
+from analytes import readings_to_entities, scanner
+from model_registry import models
+from synthetic_reports import generate_corpus
+
+STAGES = ("extract", "analyze_text", "simplify_results", "find_closest_match", "evaluate_tests", "pipeline")
+# Baseline metrics checked by --compare; p99 is too noisy on short runs to gate on
+COMPARED_METRICS = ("p50_ms", "p95_ms")
+
+
+class StubTokenizer:
+    """Word/punctuation tokenizer with the part of the HF tokenizer API chunk_text uses"""
+
+    TOKEN = re.compile(r"\w+|[^\w\s]")
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False, **kwargs):
+        offsets = [match.span() for match in self.TOKEN.finditer(text)]
+        encoded = {"input_ids": list(range(len(offsets)))}
+        if return_offsets_mapping:
+            encoded["offset_mapping"] = offsets
+        return encoded
+
+
+def stub_ner_pipeline(chunks, batch_size=None):
+    """Stands in for the NER model: lab-scanner readings in the pipeline's entity format"""
+    if isinstance(chunks, str):
+        return readings_to_entities(scanner.scan(chunks))
+    return [readings_to_entities(scanner.scan(chunk)) for chunk in chunks]
+
+
+def register_stub_models():
+    # Must run before main is imported; registration is first-come
+    models.register("ner", lambda: (stub_ner_pipeline, StubTokenizer(), "stub"))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def measure(fn, inputs, repeat=1, warmup=1, pages=None):
+    """Times fn(*args) for every input, ``repeat`` times, after ``warmup`` untimed passes"""
+    for _ in range(warmup):
+        for args in inputs:
+            fn(*args)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for args in inputs:
+            call_start = time.perf_counter()
+            fn(*args)
+            latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    result = {
+        "calls": len(latencies),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "throughput": len(latencies) / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if pages is not None:
+        result["pages_per_s"] = pages * repeat / elapsed
+    return result
+
+
+def run_benchmark(app, corpus, stages=STAGES, repeat=3, warmup=1):
+    """Runs each stage in isolation on precomputed inputs, plus the full pipeline"""
+    index = app.reference_index
+    pdfs = [(pdf,) for _, pdf, _, _ in corpus]
+    pages = sum(page_count for _, _, page_count, _ in corpus)
+
+    # Inputs for each isolated stage come from the previous one, outside the timings
+    texts = [app.extract_text_from_pdf(pdf) for (pdf,) in pdfs]
+    entities = [app.analyze_text(text) for text in texts]
+    tests = [app.simplify_results(ents) for ents in entities]
+    names = [[test.get("Test Name", "") for test in report] for report in tests]
+
+    def match_names(report_names):
+        # Cold memo, so every call does the real lookup
+        index.match.cache_clear()
+        for name in report_names:
+            app.find_closest_match(name, index)
+
+    def pipeline(pdf):
+        text = app.extract_text_from_pdf(pdf)
+        report_tests = app.simplify_results(app.analyze_text(text))
+        return app.evaluate_tests(report_tests, index)
+
+    runs = {
+        "extract": (app.extract_text_from_pdf, pdfs, pages),
+        "analyze_text": (app.analyze_text, [(text,) for text in texts], pages),
+        "simplify_results": (app.simplify_results, [(ents,) for ents in entities], None),
+        "find_closest_match": (match_names, [(report,) for report in names], None),
+        "evaluate_tests": (app.evaluate_tests, [(report, index) for report in tests], None),
+        "pipeline": (pipeline, pdfs, pages),
+    }
+
+    results = {}
+    for stage in stages:
+        fn, inputs, stage_pages = runs[stage]
+        results[stage] = measure(fn, inputs, repeat=repeat, warmup=warmup, pages=stage_pages)
+        print(f"  {stage}: p50 {results[stage]['p50_ms']:.2f} ms", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns the (stage, metric, before, after) pairs that got slower by more than threshold"""
+    regressions = []
+    for stage, current in results["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if before[metric] > 0 and current[metric] > before[metric] * (1 + threshold):
+                regressions.append((stage, metric, before[metric], current[metric]))
+    return regressions
+
+
+def format_table(results, baseline=None):
+    header = f"{'stage':<20}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'pages/s':>10}{'rss MB':>9}"
+    if baseline:
+        header += f"{'p50 vs base':>13}"
+    lines = [header]
+    for stage, r in results["stages"].items():
+        pages = f"{r['pages_per_s']:.1f}" if "pages_per_s" in r else "-"
+        line = (f"{stage:<20}{r['calls']:>7}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                f"{r['throughput']:>10.1f}{pages:>10}{r['peak_rss_mb']:>9.0f}")
+        before = (baseline or {}).get("stages", {}).get(stage)
+        if before and before["p50_ms"] > 0:
+            line += f"{(r['p50_ms'] / before['p50_ms'] - 1) * 100:>+12.1f}%"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _int_list(value):
+    return [int(part) for part in value.split(",") if part]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline on synthetic lab-report PDFs")
+    parser.add_argument("--pages", type=_int_list, default=[1, 5, 20], help="page counts, comma-separated")
+    parser.add_argument("--densities", type=_int_list, default=[5, 25], help="analytes per page, comma-separated")
+    parser.add_argument("--reports", type=int, default=3, help="reports per page count / density pair")
+    parser.add_argument("--abnormal-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the corpus per stage")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed passes before timing")
+    parser.add_argument("--stages", default=",".join(STAGES), help="stages to run, comma-separated")
+    parser.add_argument("--models", choices=("stub", "real"), default="stub",
+                        help="stub runs offline; real loads the Hugging Face NER model")
+    parser.add_argument("--no-lab-scan", action="store_true",
+                        help="disable the lab-scanner fast path so every report goes through NER")
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    parser.add_argument("--save-baseline", metavar="PATH", help="store the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="relative p50/p95 slowdown that counts as a regression (default 0.15)")
+    args = parser.parse_args(argv)
+
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    if args.no_lab_scan:
+        os.environ["LAB_SCAN_MIN_ANALYTES"] = "0"
+    if args.models == "stub":
+        register_stub_models()
+    # Imported here so the stub models and environment are in place first
+    import main as app
+
+    corpus = generate_corpus(args.seed, args.pages, args.densities, args.reports, args.abnormal_rate)
+    print(f"Benchmarking {len(corpus)} synthetic reports ({args.models} models)", file=sys.stderr)
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "models": args.models,
+            "lab_scan": not args.no_lab_scan,
+            "corpus": {"seed": args.seed, "pages": args.pages, "densities": args.densities,
+                       "reports": args.reports, "abnormal_rate": args.abnormal_rate},
+            "repeat": args.repeat,
+        },
+        "stages": run_benchmark(app, corpus, stages, args.repeat, args.warmup),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("corpus") != results["meta"]["corpus"]:
+            print("Warning: the baseline was recorded on a different corpus", file=sys.stderr)
+
+    print(format_table(results, baseline))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+    if args.save_baseline:
+        print(f"Baseline saved to {args.save_baseline}", file=sys.stderr)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for stage, metric, before, after in regressions:
+            print(f"Regression: {stage} {metric} {before:.2f} -> {after:.2f} ms", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
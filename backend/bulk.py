@@ -0,0 +1,163 @@
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+VALUE_PATTERN = re.compile(r"[-+]?\d*\.\d+|\d+")
+
+COLUMNS = [
+    "file", "test", "matched_test", "value", "unit",
+    "value_low", "value_high", "range_low", "range_high", "range_unit", "status", "error"
+]
+
+
+def evaluate_bulk(reports, reference_index, errors=()):
+    """Evaluates every test of every report in one vectorized pass.
+
+    ``reports`` is an iterable of ``(file_name, tests)`` pairs where ``tests``
+    is the output of ``simplify_results``. Returns a dict of equal-length
+    columns. ``status`` is "normal", "abnormal", "unparsed" (no numeric
+    value) or "unmatched" (no reference range), following evaluate_tests.
+    Each ``(file_name, message)`` in ``errors`` adds one row with status "error".
+    """
+    files, names, matched, values, units = [], [], [], [], []
+    for file_name, tests in reports:
+        for test in tests:
+            name = test.get("Test Name", "").strip()
+            files.append(file_name)
+            names.append(name)
+            matched.append(reference_index.match(name) or "")
+            values.append(test.get("Value", "").strip())
+            units.append(test.get("Unit", "").strip())
+
+    n = len(names)
+    low = np.full(n, np.nan)
+    high = np.full(n, np.nan)
+    count = np.zeros(n, dtype=np.int64)
+    for i, value in enumerate(values):
+        numbers = VALUE_PATTERN.findall(value)
+        count[i] = len(numbers)
+        if len(numbers) in (1, 2):
+            low[i] = float(numbers[0])
+            high[i] = float(numbers[-1])
+
+    ranges = reference_index.ranges
+    range_low = np.array([ranges[m]["range"][0] if m else np.nan for m in matched], dtype=float)
+    range_high = np.array([ranges[m]["range"][1] if m else np.nan for m in matched], dtype=float)
+    range_unit = [ranges[m]["unit"] if m else "" for m in matched]
+
+    in_range = (
+        (low >= range_low) & (low <= range_high)
+        & (high >= range_low) & (high <= range_high)
+    )
+    has_range = np.array([bool(m) for m in matched], dtype=bool)
+    # evaluate_tests treats three or more numbers as normal, so keep that here
+    status = np.select(
+        [~has_range, count == 0, (count <= 2) & ~in_range],
+        ["unmatched", "unparsed", "abnormal"],
+        default="normal"
+    )
+
+    columns = {
+        "file": files,
+        "test": names,
+        "matched_test": matched,
+        "value": values,
+        "unit": units,
+        "value_low": low.tolist(),
+        "value_high": high.tolist(),
+        "range_low": range_low.tolist(),
+        "range_high": range_high.tolist(),
+        "range_unit": range_unit,
+        "status": status.tolist(),
+        "error": [""] * n,
+    }
+    for file_name, message in errors:
+        row = dict.fromkeys(COLUMNS, "")
+        row.update(dict.fromkeys(("value_low", "value_high", "range_low", "range_high"), np.nan))
+        row.update(file=file_name, status="error", error=message)
+        for name in COLUMNS:
+            columns[name].append(row[name])
+    return columns
+
+
+def _cell(value):
+    if isinstance(value, float) and value != value:
+        return ""
+    return value
+
+
+def iter_rows(columns):
+    for row in zip(*(columns[name] for name in COLUMNS)):
+        yield [_cell(value) for value in row]
+
+
+def write_csv(columns, stream):
+    writer = csv.writer(stream)
+    writer.writerow(COLUMNS)
+    writer.writerows(iter_rows(columns))
+
+
+def to_csv(columns):
+    buffer = io.StringIO()
+    write_csv(columns, buffer)
+    return buffer.getvalue()
+
+
+def to_table(columns):
+    """Compact JSON form: the column names once, then one list per row"""
+    return {"columns": COLUMNS, "rows": list(iter_rows(columns))}
+
+
+def find_pdfs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(".pdf"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze many lab-report PDFs into one CSV table")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories to scan")
+    parser.add_argument("-o", "--output", help="CSV output path (default: stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of reports parsed concurrently")
+    args = parser.parse_args(argv)
+
+    # Imported here so --help doesn't pay for loading the NER model
+    import main as app
+
+    def load(path):
+        try:
+            with open(path, "rb") as f:
+                return path, app.extract_tests(f.read()), None
+        except Exception as e:
+            print(f"Error analyzing {path}: {str(e)}", file=sys.stderr)
+            return path, [], str(e)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(load, find_pdfs(args.paths)))
+
+    reports = [(path, tests) for path, tests, error in results if error is None]
+    errors = [(path, error) for path, _, error in results if error is not None]
+    columns = evaluate_bulk(reports, app.reference_index, errors)
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            write_csv(columns, f)
+    else:
+        write_csv(columns, sys.stdout)
+    print(f"Analyzed {len(reports)} reports, {len(columns['test']) - len(errors)} tests, "
+          f"{len(errors)} failed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+from metrics import CACHE_REQUESTS
+
+_MISS = object()
+
+
+def content_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(*parts):
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed cache for analysis results.
+
+    Values live in named layers (``text``, ``entities``, ``evaluation``) so a
+    model or reference-table change only invalidates the layers that depend on
+    it. The in-memory LRU is bounded by the pickled size of its entries; if a
+    directory is configured every entry is also written there and read back on
+    a memory miss, so the cache survives restarts.
+
+    The directory is bounded by ``max_disk_bytes``: reads refresh a file's
+    mtime, and once the files written push the total over the limit the least
+    recently used ones are deleted. The total is re-measured from the directory
+    each time, so workers sharing it keep it bounded together.
+
+    Coroutines use ``aget``/``aput``: memory hits are served inline, while disk
+    reads, writes and pruning run on a thread so they never block the event loop.
+    """
+
+    LAYERS = ("text", "entities", "evaluation")
+    # Pruning frees down to this fraction of max_disk_bytes, so it doesn't run on every write
+    PRUNE_TO = 0.9
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, max_disk_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self.hits = {layer: 0 for layer in self.LAYERS}
+        self.misses = {layer: 0 for layer in self.LAYERS}
+
+        if directory:
+            for layer in self.LAYERS:
+                os.makedirs(os.path.join(directory, layer), exist_ok=True)
+            self._disk_size = sum(size for _, size, _ in self._disk_files())
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(float(os.environ.get("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024),
+            directory=os.environ.get("RESULT_CACHE_DIR") or None,
+            max_disk_bytes=int(float(os.environ.get("RESULT_CACHE_DISK_MAX_MB", "1024")) * 1024 * 1024),
+        )
+
+    @property
+    def disk_size(self):
+        return self._disk_size
+
+    @property
+    def size(self):
+        return self._size
+
+    def _path(self, layer, key):
+        return os.path.join(self.directory, layer, f"{key}.pkl")
+
+    def get(self, layer, key):
+        value = self._get_memory(layer, key)
+        return self._get_disk(layer, key) if value is _MISS else value
+
+    def put(self, layer, key, value):
+        self._write_disk(layer, key, self._put_memory(layer, key, value))
+
+    async def aget(self, layer, key):
+        value = self._get_memory(layer, key)
+        if value is not _MISS:
+            return value
+        if not self.directory:
+            return self._get_disk(layer, key)
+        return await asyncio.to_thread(self._get_disk, layer, key)
+
+    async def aput(self, layer, key, value):
+        blob = self._put_memory(layer, key, value)
+        if self.directory:
+            # The memory layer already answers reads; the disk copy is written in the background
+            asyncio.get_running_loop().run_in_executor(None, self._write_disk, layer, key, blob)
+
+    def _get_memory(self, layer, key):
+        with self._lock:
+            entry = self._entries.get((layer, key))
+            if entry is None:
+                return _MISS
+            self._entries.move_to_end((layer, key))
+            self.hits[layer] += 1
+        CACHE_REQUESTS.labels(layer, "hit").inc()
+        return pickle.loads(entry)
+
+    def _get_disk(self, layer, key):
+        blob = self._read_disk(layer, key)
+        if blob is None:
+            with self._lock:
+                self.misses[layer] += 1
+            CACHE_REQUESTS.labels(layer, "miss").inc()
+            return None
+
+        with self._lock:
+            self.hits[layer] += 1
+            self._store(layer, key, blob)
+        CACHE_REQUESTS.labels(layer, "hit").inc()
+        return pickle.loads(blob)
+
+    def _put_memory(self, layer, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._store(layer, key, blob)
+        return blob
+
+    def _store(self, layer, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        previous = self._entries.pop((layer, key), None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[(layer, key)] = blob
+        self._size += len(blob)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _read_disk(self, layer, key):
+        if not self.directory:
+            return None
+        path = self._path(layer, key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            # Marks the entry as recently used for pruning
+            os.utime(path)
+            return blob
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Cache read failed for {layer}/{key}: {str(e)}")
+            return None
+
+    def _write_disk(self, layer, key, blob):
+        if not self.directory:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.directory, layer))
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp_path, self._path(layer, key))
+        except OSError as e:
+            print(f"Cache write failed for {layer}/{key}: {str(e)}")
+            return
+
+        with self._lock:
+            self._disk_size += len(blob)
+            over = self._disk_size > self.max_disk_bytes
+        if over:
+            self._prune_disk()
+
+    def _disk_files(self):
+        """(mtime, size, path) of every cache file in the directory"""
+        files = []
+        for layer in self.LAYERS:
+            with os.scandir(os.path.join(self.directory, layer)) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".pkl"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _prune_disk(self):
+        # One prune at a time; writes that arrive meanwhile are covered by it
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            files = sorted(self._disk_files())
+            total = sum(size for _, size, _ in files)
+            target = self.max_disk_bytes * self.PRUNE_TO
+            removed = 0
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+            with self._lock:
+                self._disk_size = total
+            print(f"Cache pruned {removed} files, {total} bytes on disk")
+        except OSError as e:
+            print(f"Cache prune failed: {str(e)}")
+        finally:
+            self._prune_lock.release()
@@ -0,0 +1,80 @@
+def _continues_word(offsets, i):
+    """True if token ``i`` starts exactly where the previous token ended"""
+    return offsets[i][0] == offsets[i - 1][1]
+
+
+def chunk_text(text, tokenizer, max_tokens=512, stride=64):
+    """Split text into windows that fill the model's token limit.
+
+    Windows overlap by roughly ``stride`` tokens and are cut only between
+    words, so a lab name and its value are never separated at a boundary.
+    Returns a list of ``(start_char, window_text)`` tuples.
+    """
+    if not text.strip():
+        return []
+
+    budget = max_tokens - tokenizer.num_special_tokens_to_add()
+    offsets = tokenizer(
+        text,
+        add_special_tokens=False,
+        return_offsets_mapping=True
+    )["offset_mapping"]
+
+    if len(offsets) <= budget:
+        return [(0, text)]
+
+    windows = []
+    start = 0
+    while True:
+        end = min(start + budget, len(offsets))
+        if end < len(offsets):
+            cut = end
+            while cut > start + 1 and _continues_word(offsets, cut):
+                cut -= 1
+            if cut > start + 1:
+                end = cut
+
+        start_char, end_char = offsets[start][0], offsets[end - 1][1]
+        windows.append((start_char, text[start_char:end_char]))
+        if end >= len(offsets):
+            break
+
+        next_start = max(end - stride, start + 1)
+        while next_start > start + 1 and _continues_word(offsets, next_start):
+            next_start -= 1
+        start = next_start
+
+    return windows
+
+
+def merge_entities(windows, window_entities):
+    """Map per-window entities back onto the full text as one ordered stream.
+
+    Entities found twice in an overlap are de-duplicated, keeping the copy
+    that sat furthest from its window's edge (i.e. had the most context).
+    """
+    candidates = []
+    for (offset, window), entities in zip(windows, window_entities):
+        for entity in entities:
+            if entity.get("start") is None:
+                candidates.append((entity, 0))
+                continue
+            margin = min(entity["start"], len(window) - entity["end"])
+            candidates.append((
+                dict(entity, start=entity["start"] + offset, end=entity["end"] + offset),
+                margin
+            ))
+
+    candidates.sort(key=lambda c: (c[0].get("start") or 0, -(c[0].get("end") or 0)))
+
+    merged = []
+    for entity, margin in candidates:
+        if merged and entity.get("start") is not None:
+            previous, previous_margin = merged[-1]
+            if previous.get("end") is not None and entity["start"] < previous["end"]:
+                if (margin, entity["score"]) > (previous_margin, previous["score"]):
+                    merged[-1] = (entity, margin)
+                continue
+        merged.append((entity, margin))
+
+    return [entity for entity, _ in merged]
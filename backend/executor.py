@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+from metrics import EXECUTOR_IN_FLIGHT
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the admission queue is full and a request must be rejected"""
+
+
+class ExecutorTimeout(Exception):
+    """Raised when a request exceeds its time budget"""
+
+
+class AnalysisExecutor:
+    """Runs CPU-bound analysis stages on a bounded worker pool.
+
+    At most ``max_workers + max_queue`` requests are admitted at once; anything
+    beyond that is rejected immediately instead of piling up behind the pool.
+    A request keeps its admission slot until the last stage it submitted has
+    actually finished, so timed-out work still counts against the bound.
+    """
+
+    def __init__(self, kind="thread", max_workers=None, max_queue=8, timeout=120.0):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        workers = os.environ.get("ANALYSIS_WORKERS")
+        return cls(
+            kind=os.environ.get("ANALYSIS_EXECUTOR", "thread"),
+            max_workers=int(workers) if workers else None,
+            max_queue=int(os.environ.get("ANALYSIS_QUEUE_SIZE", "8")),
+            timeout=float(os.environ.get("ANALYSIS_TIMEOUT", "120")),
+        )
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="analysis"
+                )
+        return self._pool
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        EXECUTOR_IN_FLIGHT.dec()
+
+    def open_job(self, timeout=None):
+        """Admit a request, or raise ExecutorSaturated. The caller must close() the job"""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                raise ExecutorSaturated(
+                    f"Analysis queue is full ({self._in_flight}/{self.capacity} in flight)"
+                )
+            self._in_flight += 1
+        EXECUTOR_IN_FLIGHT.inc()
+        return _Job(self, time.monotonic() + (timeout or self.timeout))
+
+    @asynccontextmanager
+    async def admit(self, timeout=None):
+        job = self.open_job(timeout)
+        try:
+            yield job
+        finally:
+            job.close()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class _Job:
+    """A single admitted request; submits its stages against a shared deadline"""
+
+    def __init__(self, executor, deadline):
+        self._executor = executor
+        self.deadline = deadline
+        self._pending = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    async def run(self, fn, *args):
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise ExecutorTimeout("Request deadline exceeded")
+
+        with self._lock:
+            # A closed job has given its slot back; running more work would release it twice
+            if self._closed:
+                raise ExecutorTimeout("Job is closed")
+            if self._executor.kind == "thread":
+                # Carry the request's context (e.g. its profiling spans) into the pool thread
+                future = self._executor._get_pool().submit(contextvars.copy_context().run, fn, *args)
+            else:
+                future = self._executor._get_pool().submit(fn, *args)
+            self._pending.add(future)
+        future.add_done_callback(self._on_done)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), remaining)
+        except asyncio.TimeoutError:
+            raise ExecutorTimeout(f"{getattr(fn, '__name__', 'stage')} timed out")
+
+    def _on_done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            release = self._closed and not self._pending
+        if release:
+            self._executor._release()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            pending = list(self._pending)
+            release = not pending
+        for future in pending:
+            future.cancel()
+        if release:
+            self._executor._release()
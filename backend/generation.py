@@ -0,0 +1,105 @@
+import copy
+import threading
+
+from metrics import GENERATED_TOKENS
+
+
+class ReportPrefix:
+    """The report text shared by every prompt of one analysis, encoded once.
+
+    The first call to ``encode`` runs a single prefill over the prefix and
+    keeps its KV cache. Follow-up prompts only append their own suffix, so
+    each of them pays for its suffix tokens instead of re-encoding the report.
+    """
+
+    def __init__(self, text, max_chars=1000):
+        self.text = f"Medical report text:\n{text[:max_chars]}\n\n"
+        self.input_ids = None
+        self.past_key_values = None
+        self._lock = threading.Lock()
+
+    def encode(self, model, tokenizer):
+        import torch
+
+        with self._lock:
+            if self.past_key_values is None:
+                input_ids = tokenizer(self.text, return_tensors="pt").input_ids.to(model.device)
+                with torch.no_grad():
+                    outputs = model(input_ids=input_ids, use_cache=True)
+                self.input_ids = input_ids
+                self.past_key_values = outputs.past_key_values
+        return self
+
+    def extend(self, model, tokenizer, suffix):
+        """Returns (input_ids, past_key_values) for prefix + suffix, with a private cache copy"""
+        import torch
+
+        self.encode(model, tokenizer)
+        suffix_ids = tokenizer(
+            suffix, add_special_tokens=False, return_tensors="pt"
+        ).input_ids.to(model.device)
+        input_ids = torch.cat([self.input_ids, suffix_ids], dim=1)
+        # generate() appends to the cache in place, so every prompt gets its own copy
+        return input_ids, copy.deepcopy(self.past_key_values)
+
+
+def next_token_logits(model, tokenizer, prefix, suffix):
+    """Logits for the token following prefix + suffix, reusing the prefix's KV cache"""
+    import torch
+
+    input_ids, past_key_values = prefix.extend(model, tokenizer, suffix)
+    new_ids = input_ids[:, prefix.input_ids.shape[1]:]
+    with torch.no_grad():
+        outputs = model(
+            input_ids=new_ids,
+            past_key_values=past_key_values,
+            attention_mask=torch.ones_like(input_ids),
+            use_cache=True
+        )
+    return outputs.logits[0, -1]
+
+
+def generate_with_prefix(model, tokenizer, prefix, suffix, **generate_kwargs):
+    """Generates a reply to prefix + suffix and decodes only the newly generated tokens"""
+    import torch
+
+    input_ids, past_key_values = prefix.extend(model, tokenizer, suffix)
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=past_key_values,
+            pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+            **generate_kwargs
+        )
+    GENERATED_TOKENS.inc(outputs.shape[1] - input_ids.shape[1])
+    return tokenizer.decode(outputs[0, input_ids.shape[1]:], skip_special_tokens=True)
+
+
+def parse_structured_response(response):
+    """Parses the Classification/Confidence/Summary/Terms/Recommendations reply format"""
+    parsed = {
+        "classification": "NORMAL",
+        "confidence": 0.8,  # Default confidence
+        "summary": "",
+        "terms": [],
+        "recommendations": [],
+    }
+    for line in response.split('\n'):
+        line = line.strip()
+        if line.startswith('Classification:'):
+            parsed["classification"] = "ABNORMAL" if "ABNORMAL" in line.upper() else "NORMAL"
+        elif line.startswith('Confidence:'):
+            try:
+                parsed["confidence"] = min(max(float(line.replace('Confidence:', '').strip()), 0.0), 1.0)
+            except ValueError:
+                pass
+        elif line.startswith('Summary:'):
+            parsed["summary"] = line.replace('Summary:', '').strip()
+        elif line.startswith('Terms:'):
+            parsed["terms"] = [
+                term.strip() for term in line.replace('Terms:', '').split(',') if term.strip()
+            ]
+        elif line.startswith('-'):
+            parsed["recommendations"].append(line)
+    return parsed
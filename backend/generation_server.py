@@ -0,0 +1,333 @@
+import asyncio
+import itertools
+import os
+import queue
+import threading
+
+from metrics import GENERATED_TOKENS, SCHEDULER_ACTIVE, SCHEDULER_QUEUE_DEPTH
+
+
+def cache_layers(past_key_values):
+    """Per-layer (key, value) tensors from any transformers cache format"""
+    if isinstance(past_key_values, (tuple, list)):
+        return [(k, v) for k, v, *_ in past_key_values]
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    return [(k, v) for k, v, *_ in past_key_values.to_legacy_cache()]
+
+
+def make_cache(layers):
+    from transformers import DynamicCache
+
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(ddp_cache_data=layers)
+
+
+class _Sequence:
+    def __init__(self, request_id, input_ids, max_new_tokens, temperature, do_sample,
+                 prefix_layers, loop):
+        self.id = request_id
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.do_sample = do_sample
+        self.prefix_layers = prefix_layers
+        self.loop = loop
+        self.tokens = queue.SimpleQueue() if loop is None else asyncio.Queue()
+        self.generated = 0
+        self.length = 0
+        self.last_token = None
+        self.cancelled = False
+
+    @property
+    def reserved_tokens(self):
+        return len(self.input_ids) + self.max_new_tokens
+
+    def emit(self, item):
+        if self.loop is None:
+            self.tokens.put(item)
+        else:
+            self.loop.call_soon_threadsafe(self.tokens.put_nowait, item)
+
+
+_DONE = object()
+
+
+class GenerationScheduler:
+    """In-process continuous batching for a causal LM.
+
+    A background thread keeps one running decode batch. Between decode steps
+    it retires sequences that hit EOS or their token limit and admits waiting
+    ones (after a single-sequence prefill), so new requests never wait for the
+    whole batch to finish. ``max_batch_size`` caps concurrent sequences and
+    ``max_tokens`` caps the prompt + generation tokens reserved by the batch.
+
+    The batched KV cache is left-padded to a common length; each row's padding
+    is masked out and positions are tracked per sequence, so rows of different
+    lengths decode together. Works with any transformers causal LM, including
+    a tiny randomly initialized one on CPU.
+    """
+
+    def __init__(self, model, eos_token_id=None, max_batch_size=8, max_tokens=8192):
+        self.model = model
+        if eos_token_id is None:
+            eos_token_id = model.config.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self.eos_token_ids = set(eos_token_id or [])
+        self.max_batch_size = max_batch_size
+        self.max_tokens = max_tokens
+
+        self._waiting = queue.Queue()
+        self._active = []
+        self._layers = None
+        self._pads = []
+        self._ids = itertools.count()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+        self.tokens_generated = 0
+
+    @classmethod
+    def from_env(cls, model, eos_token_id=None):
+        return cls(
+            model,
+            eos_token_id=eos_token_id,
+            max_batch_size=int(os.environ.get("LLM_MAX_BATCH_SIZE", "8")),
+            max_tokens=int(os.environ.get("LLM_MAX_BATCH_TOKENS", "8192")),
+        )
+
+    @property
+    def active_sequences(self):
+        return len(self._active)
+
+    @property
+    def queue_depth(self):
+        return self._waiting.qsize()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="llm-scheduler", daemon=True)
+                self._thread.start()
+
+    def _submit(self, input_ids, max_new_tokens, temperature, do_sample, prefix, loop):
+        prefix_layers = None
+        if prefix is not None:
+            prefix_ids, prefix_cache = prefix
+            prefix_layers = cache_layers(prefix_cache)
+            input_ids = list(prefix_ids) + list(input_ids)
+        sequence = _Sequence(
+            next(self._ids), list(input_ids), max_new_tokens, temperature, do_sample,
+            prefix_layers, loop
+        )
+        self._ensure_thread()
+        self._waiting.put(sequence)
+        return sequence
+
+    async def stream(self, input_ids, max_new_tokens=256, temperature=1.0, do_sample=False, prefix=None):
+        """Yields generated token ids as they are decoded.
+
+        ``prefix`` is an optional ``(prefix_ids, past_key_values)`` pair whose
+        cache covers ``prefix_ids``; ``input_ids`` then only holds the suffix.
+        """
+        sequence = self._submit(
+            input_ids, max_new_tokens, temperature, do_sample, prefix, asyncio.get_running_loop()
+        )
+        try:
+            while True:
+                item = await sequence.tokens.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            sequence.cancelled = True
+
+    async def generate(self, input_ids, **kwargs):
+        return [token async for token in self.stream(input_ids, **kwargs)]
+
+    def close(self):
+        self._stopped = True
+        self._waiting.put(None)
+
+    # Scheduler thread
+
+    def _reserved(self):
+        return sum(seq.reserved_tokens for seq in self._active)
+
+    def _loop(self):
+        import torch
+
+        with torch.no_grad():
+            while not self._stopped:
+                try:
+                    self._admit()
+                    if self._active:
+                        self._decode_step()
+                    SCHEDULER_ACTIVE.set(len(self._active))
+                    SCHEDULER_QUEUE_DEPTH.set(self._waiting.qsize())
+                except Exception as e:
+                    # Callers see the error through their llm.generate span
+                    print(f"Generation scheduler error: {str(e)}")
+                    for sequence in self._active:
+                        sequence.emit(e)
+                        sequence.emit(_DONE)
+                    self._active, self._layers, self._pads = [], None, []
+
+    def _admit(self):
+        while len(self._active) < self.max_batch_size:
+            try:
+                # Block only when there is nothing to decode
+                sequence = self._waiting.get(block=not self._active)
+            except queue.Empty:
+                return
+            if sequence is None:
+                return
+            if sequence.cancelled:
+                continue
+            if self._active and self._reserved() + sequence.reserved_tokens > self.max_tokens:
+                # Put it back at the head of the line once capacity frees up
+                self._requeue_front(sequence)
+                return
+            try:
+                self._prefill(sequence)
+            except Exception as e:
+                # Only this request fails; the running batch is untouched
+                print(f"Generation prefill error: {str(e)}")
+                sequence.emit(e)
+                sequence.emit(_DONE)
+
+    def _requeue_front(self, sequence):
+        with self._waiting.mutex:
+            self._waiting.queue.appendleft(sequence)
+            self._waiting.not_empty.notify()
+
+    def _sample(self, logits, sequences):
+        import torch
+
+        next_tokens = []
+        for row, sequence in zip(logits, sequences):
+            if sequence.do_sample and sequence.temperature > 0:
+                probs = torch.softmax(row.float() / sequence.temperature, dim=-1)
+                next_tokens.append(int(torch.multinomial(probs, 1)))
+            else:
+                next_tokens.append(int(row.argmax()))
+        return next_tokens
+
+    def _prefill(self, sequence):
+        import torch
+
+        device = self.model.device
+        cached = 0
+        past_key_values = None
+        if sequence.prefix_layers is not None:
+            cached = sequence.prefix_layers[0][0].shape[2]
+            past_key_values = make_cache(sequence.prefix_layers)
+            sequence.prefix_layers = None
+
+        input_ids = torch.tensor([sequence.input_ids[cached:]], device=device)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=torch.ones((1, len(sequence.input_ids)), dtype=torch.long, device=device),
+            past_key_values=past_key_values,
+            use_cache=True
+        )
+        sequence.length = len(sequence.input_ids)
+        token = self._sample(outputs.logits[:, -1], [sequence])[0]
+        if self._advance(sequence, token):
+            self._join_batch(sequence, cache_layers(outputs.past_key_values))
+
+    def _advance(self, sequence, token):
+        """Emits a token; returns False once the sequence is finished"""
+        sequence.generated += 1
+        self.tokens_generated += 1
+        GENERATED_TOKENS.inc()
+        if token in self.eos_token_ids:
+            sequence.emit(_DONE)
+            return False
+        sequence.emit(token)
+        sequence.last_token = token
+        if sequence.generated >= sequence.max_new_tokens or sequence.cancelled:
+            sequence.emit(_DONE)
+            return False
+        return True
+
+    def _join_batch(self, sequence, layers):
+        import torch
+
+        def left_pad(tensor, amount):
+            if amount == 0:
+                return tensor
+            shape = list(tensor.shape)
+            shape[2] = amount
+            return torch.cat([tensor.new_zeros(shape), tensor], dim=2)
+
+        if self._layers is None:
+            self._layers = layers
+            self._pads = [0]
+            self._active = [sequence]
+            return
+
+        batch_len = self._layers[0][0].shape[2]
+        new_len = layers[0][0].shape[2]
+        if new_len > batch_len:
+            grow = new_len - batch_len
+            self._layers = [(left_pad(k, grow), left_pad(v, grow)) for k, v in self._layers]
+            self._pads = [pad + grow for pad in self._pads]
+            batch_len = new_len
+
+        pad = batch_len - new_len
+        self._layers = [
+            (torch.cat([bk, left_pad(k, pad)], dim=0), torch.cat([bv, left_pad(v, pad)], dim=0))
+            for (bk, bv), (k, v) in zip(self._layers, layers)
+        ]
+        self._pads.append(pad)
+        self._active.append(sequence)
+
+    def _decode_step(self):
+        import torch
+
+        device = self.model.device
+        batch_len = self._layers[0][0].shape[2]
+        attention_mask = torch.ones((len(self._active), batch_len + 1), dtype=torch.long, device=device)
+        for row, pad in enumerate(self._pads):
+            attention_mask[row, :pad] = 0
+
+        outputs = self.model(
+            input_ids=torch.tensor([[seq.last_token] for seq in self._active], device=device),
+            attention_mask=attention_mask,
+            position_ids=torch.tensor([[seq.length] for seq in self._active], device=device),
+            past_key_values=make_cache(self._layers),
+            use_cache=True
+        )
+        self._layers = cache_layers(outputs.past_key_values)
+
+        keep = []
+        for row, (sequence, token) in enumerate(
+                zip(self._active, self._sample(outputs.logits[:, -1], self._active))):
+            sequence.length += 1
+            if self._advance(sequence, token):
+                keep.append(row)
+
+        if len(keep) < len(self._active):
+            self._retire(keep)
+
+    def _retire(self, keep):
+        import torch
+
+        if not keep:
+            self._active, self._layers, self._pads = [], None, []
+            return
+        index = torch.tensor(keep, device=self._layers[0][0].device)
+        self._active = [self._active[row] for row in keep]
+        self._pads = [self._pads[row] for row in keep]
+        # Drop the padding columns no remaining row needs
+        trim = min(self._pads)
+        self._pads = [pad - trim for pad in self._pads]
+        self._layers = [
+            (k.index_select(0, index)[:, :, trim:], v.index_select(0, index)[:, :, trim:])
+            for k, v in self._layers
+        ]
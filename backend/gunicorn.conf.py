@@ -0,0 +1,89 @@
+"""Multi-worker serving: gunicorn -c gunicorn.conf.py main:app
+
+The app and its models are loaded once in the master and shared with every
+forked worker copy-on-write, so N workers cost roughly one copy of the
+weights. Each worker gets its own share of the cores for torch.
+
+Report jobs and chat sessions are kept in STATE_DIR, which every worker
+reads, so a follow-up request can be served by any of them. Only the chat
+index cache is per worker, and a miss there just rebuilds the index.
+Prometheus metrics are written to PROMETHEUS_MULTIPROC_DIR so /metrics
+reports every worker, whichever one serves the scrape.
+
+The master loads the models before it forks, so no worker answers
+/healthz or /readyz until loading is done. Give health probes a startup
+grace period (see the Dockerfile's HEALTHCHECK).
+"""
+import gc
+import glob
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+# LLM analyses can legitimately hold a request for minutes
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "600"))
+graceful_timeout = 30
+preload_app = True
+
+# Must be set, and cleared of a previous run's metric files, before the app imports prometheus_client.
+# Only the *.db files are removed, since an operator may point this at a directory shared with other data
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus-multiproc")
+)
+os.makedirs(metrics_dir, exist_ok=True)
+for stale in glob.glob(os.path.join(metrics_dir, "*.db")):
+    os.remove(stale)
+
+# Shared by the workers for jobs and chat sessions; kept across restarts, so sessions survive them
+os.environ.setdefault("STATE_DIR", os.path.join(tempfile.gettempdir(), "report-analyzer-state"))
+
+
+def when_ready(server):
+    """Loads the configured models in the master, before any worker is forked"""
+    import torch
+    from inference import verifies_backend
+    from model_registry import models, warmup_names_from_env
+
+    if torch.cuda.is_available():
+        # A CUDA context doesn't survive fork; each worker loads its own copy instead
+        server.log.info("CUDA available, skipping model preload in the master")
+        return
+
+    # Load only: running inference here would start torch's thread pools, which don't survive fork
+    for name in warmup_names_from_env(["ner"]):
+        if not models.is_registered(name):
+            continue
+        if name == "ner" and verifies_backend():
+            # Backend verification runs inference, so each worker loads and verifies its own copy
+            server.log.info("NER backend verification enabled, skipping its preload in the master")
+            continue
+        try:
+            models.get(name)
+            server.log.info(f"Preloaded {name}")
+        except Exception as e:
+            server.log.warning(f"Could not preload {name}: {str(e)}")
+
+    # Keep the garbage collector from writing to (and so un-sharing) the preloaded objects
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Splits the cores between workers so their torch thread pools don't oversubscribe"""
+    from inference import configure_threads
+
+    intra_op = os.environ.get("NER_INTRA_OP_THREADS")
+    inter_op = os.environ.get("NER_INTER_OP_THREADS")
+    threads = int(intra_op) if intra_op else max(1, multiprocessing.cpu_count() // server.cfg.workers)
+    configure_threads(threads, int(inter_op) if inter_op else 1)
+    server.log.info(f"Worker {worker.pid} using {threads} torch threads")
+
+
+def child_exit(server, worker):
+    """Drops a dead worker's live gauges so they stop counting towards the totals"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
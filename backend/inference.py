@@ -0,0 +1,121 @@
+import os
+
+BACKENDS = ("fp32", "int8", "onnx")
+
+# Short lab-report lines used to check that an optimized backend still agrees with fp32
+VERIFY_SAMPLES = [
+    "Hemoglobin 13.2 g/dL, White Blood Cell (WBC) 7.1 K/uL, Platelet Count 250 K/uL.",
+    "Glucose 126 mg/dL fasting. HbA1c 6.8 %. Creatinine 1.4 mg/dL.",
+    "Total Cholesterol 220 mg/dL, HDL Cholesterol 38 mg/dL, LDL Cholesterol 150 mg/dL.",
+    "TSH 5.2 mIU/L with T4 (Thyroxine) 4.1 ug/dL. Patient reports fatigue.",
+    "Sodium 134 mEq/L, Potassium 5.6 mEq/L, Chloride 101 mEq/L, Calcium 9.1 mg/dL.",
+]
+
+
+def configure_threads(intra_op=None, inter_op=None):
+    """Pins torch's thread pools; must run before the first forward pass"""
+    import torch
+
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            # Can only be set once, before any inter-op work has started
+            print(f"Could not set inter-op threads: {str(e)}")
+
+
+def load_token_classifier(model_name, backend="fp32", intra_op=None, inter_op=None):
+    """Loads the NER model for the given backend and returns (model, tokenizer)"""
+    from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    if backend == "onnx":
+        try:
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForTokenClassification
+        except ImportError:
+            raise RuntimeError("The onnx backend requires: pip install optimum[onnxruntime]")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op:
+            options.intra_op_num_threads = intra_op
+        if inter_op:
+            options.inter_op_num_threads = inter_op
+        model = ORTModelForTokenClassification.from_pretrained(
+            model_name,
+            export=True,
+            session_options=options,
+            provider="CPUExecutionProvider"
+        )
+        return model, tokenizer
+
+    import torch
+
+    configure_threads(intra_op, inter_op)
+    model = AutoModelForTokenClassification.from_pretrained(model_name)
+    model.eval()
+    if backend == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model, tokenizer
+
+
+def _entity_signature(entities):
+    return [(e["entity_group"], e["start"], e["end"]) for e in entities]
+
+
+def verify_backend(candidate, baseline, samples=VERIFY_SAMPLES):
+    """Returns the samples on which two NER pipelines disagree"""
+    mismatches = []
+    for sample in samples:
+        expected = _entity_signature(baseline(sample))
+        actual = _entity_signature(candidate(sample))
+        if expected != actual:
+            mismatches.append({"text": sample, "expected": expected, "actual": actual})
+    return mismatches
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def verifies_backend(backend=None):
+    """Whether loading the NER pipeline runs inference to check the backend against fp32"""
+    backend = backend or os.environ.get("NER_BACKEND", "fp32")
+    return backend != "fp32" and os.environ.get("NER_VERIFY_BACKEND", "1") == "1"
+
+
+def load_ner_pipeline(model_name):
+    """Builds the NER pipeline from NER_BACKEND, NER_INTRA_OP_THREADS, NER_INTER_OP_THREADS.
+
+    With NER_VERIFY_BACKEND=1 (the default) a non-fp32 backend is compared against the fp32
+    model on VERIFY_SAMPLES at startup and replaced by fp32 if they disagree.
+    """
+    from transformers import pipeline
+
+    backend = os.environ.get("NER_BACKEND", "fp32")
+    intra_op = _env_int("NER_INTRA_OP_THREADS")
+    inter_op = _env_int("NER_INTER_OP_THREADS")
+
+    model, tokenizer = load_token_classifier(model_name, backend, intra_op, inter_op)
+    ner_pipeline = pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="simple")
+
+    if verifies_backend(backend):
+        baseline_model, _ = load_token_classifier(model_name, "fp32")
+        baseline = pipeline("ner", model=baseline_model, tokenizer=tokenizer, aggregation_strategy="simple")
+        mismatches = verify_backend(ner_pipeline, baseline)
+        if mismatches:
+            print(f"{backend} backend disagrees with fp32 on {len(mismatches)} samples, falling back to fp32")
+            for mismatch in mismatches:
+                print(f"  {mismatch['text']}")
+            return baseline, tokenizer, "fp32"
+        print(f"{backend} backend matches fp32 on {len(VERIFY_SAMPLES)} samples")
+
+    return ner_pipeline, tokenizer, backend
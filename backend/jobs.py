@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+TERMINAL_STATUSES = ("complete", "error")
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class TooManyJobs(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"
+        self.stage = None
+        self.percent = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.updated = self.created
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        job = cls(snapshot["job_id"])
+        job.status = snapshot["status"]
+        job.stage = snapshot["stage"]
+        job.percent = snapshot["percent"]
+        job.result = snapshot.get("result")
+        job.error = snapshot.get("error")
+        job.updated = snapshot["updated"]
+        return job
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATUSES
+
+    def snapshot(self, include_result=True):
+        snapshot = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "percent": self.percent,
+            "updated": self.updated,
+        }
+        if self.error is not None:
+            snapshot["error"] = self.error
+        if include_result and self.result is not None:
+            snapshot["result"] = self.result
+        return snapshot
+
+
+class JobStore:
+    """Tracks per-job progress and pushes every change to its subscribers.
+
+    Progress is advanced by the code doing the work as each stage actually
+    finishes, so there is no synthetic delay. Updates may come from any thread;
+    subscribers receive snapshots on their own event loop. At most
+    ``max_active`` jobs may be unfinished at once in this process.
+
+    If a directory is configured every job's latest snapshot is also written
+    there, so workers sharing it can answer for each other's jobs: ``get``
+    falls back to the file, and ``subscribe`` polls it.
+    """
+
+    # How often a subscriber re-reads a job that another worker is running
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, ttl=3600, max_jobs=1000, max_active=8, directory=None):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.max_active = max_active
+        self.directory = directory
+        self._jobs = OrderedDict()
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        state_dir = os.environ.get("STATE_DIR")
+        return cls(
+            ttl=float(os.environ.get("JOB_TTL", "3600")),
+            max_jobs=int(os.environ.get("JOB_MAX_STORED", "1000")),
+            max_active=int(os.environ.get("LLM_MAX_JOBS", "8")),
+            directory=os.path.join(state_dir, "jobs") if state_dir else None,
+        )
+
+    @property
+    def active(self):
+        return sum(1 for job in self._jobs.values() if not job.done)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _save(self, snapshot):
+        # Written whole and renamed into place, so readers never see a partial file
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._path(snapshot["job_id"]))
+        except OSError as e:
+            print(f"Could not save job {snapshot['job_id']}: {str(e)}")
+
+    def _load(self, job_id):
+        try:
+            with open(self._path(job_id)) as f:
+                return Job.from_snapshot(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _remove(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+    def _prune(self):
+        # Unfinished jobs are never evicted: their tasks still update them and clients still poll them
+        cutoff = time.time() - self.ttl
+        excess = len(self._jobs) - self.max_jobs
+        for job_id, job in list(self._jobs.items()):
+            if job.done and (excess > 0 or job.updated < cutoff):
+                self._jobs.pop(job_id)
+                self._subscribers.pop(job_id, None)
+                if self.directory:
+                    self._remove(job_id)
+                excess -= 1
+
+        if self.directory:
+            # Files other workers left behind: a running job rewrites its file at every stage
+            for name in os.listdir(self.directory):
+                job_id, ext = os.path.splitext(name)
+                if ext != ".json" or job_id in self._jobs:
+                    continue
+                try:
+                    if os.stat(self._path(job_id)).st_mtime < cutoff:
+                        os.remove(self._path(job_id))
+                except OSError:
+                    pass
+
+    def create(self):
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._prune()
+            if self.active >= self.max_active:
+                raise TooManyJobs(f"{self.max_active} jobs are already running")
+            self._jobs[job.id] = job
+            self._subscribers[job.id] = []
+            if self.directory:
+                self._save(job.snapshot())
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.directory and JOB_ID.fullmatch(job_id):
+            # Possibly another worker's job
+            job = self._load(job_id)
+        return job
+
+    def update(self, job, status=None, stage=None, percent=None, result=None, error=None):
+        with self._lock:
+            if status is not None:
+                job.status = status
+            if stage is not None:
+                job.stage = stage
+            if percent is not None:
+                job.percent = percent
+            if result is not None:
+                job.result = result
+            if error is not None:
+                job.error = error
+            job.updated = time.time()
+            snapshot = job.snapshot()
+            subscribers = list(self._subscribers.get(job.id, ()))
+            # Under the lock, so concurrent updates can't land on disk out of order
+            if self.directory:
+                self._save(snapshot)
+
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+
+    def progress_callback(self, job):
+        """Adapter for analyzers that report (stage, percent) as they go"""
+        def on_progress(stage, percent):
+            self.update(job, status="running", stage=stage, percent=percent)
+        return on_progress
+
+    async def subscribe(self, job):
+        """Yields the current snapshot, then every update until the job finishes"""
+        if self._jobs.get(job.id) is not job:
+            async for snapshot in self._follow(job):
+                yield snapshot
+            return
+
+        queue = asyncio.Queue()
+        entry = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.setdefault(job.id, []).append(entry)
+            snapshot = job.snapshot()
+        try:
+            yield snapshot
+            while snapshot["status"] not in TERMINAL_STATUSES:
+                snapshot = await queue.get()
+                yield snapshot
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(job.id, [])
+                if entry in subscribers:
+                    subscribers.remove(entry)
+
+    async def _follow(self, job):
+        """Polls the file of a job another worker is running"""
+        snapshot = job.snapshot()
+        yield snapshot
+        while snapshot["status"] not in TERMINAL_STATUSES:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            current = await asyncio.to_thread(self._load, job.id)
+            if current is None:
+                return
+            if current.updated != snapshot["updated"]:
+                snapshot = current.snapshot()
+                yield snapshot
@@ -1,13 +1,105 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import AsyncExitStack
+import asyncio
+import json
+import math
 import re
-from difflib import get_close_matches
-import pdfplumber
-from transformers import pipeline, AutoTokenizer, AutoModelForTokenClassification
-import io
+import base64
+import gzip
+import os
+import time
+from typing import List
+from executor import AnalysisExecutor, ExecutorSaturated, ExecutorTimeout
+from batching import MicroBatcher
+from chunking import chunk_text, merge_entities
+from cache import ResultCache, content_digest, make_key
+from reference_index import ReferenceRangeIndex
+from analytes import IGNORED_NAMES, readings_to_entities, reference_aliases, reference_ranges, scanner
+from bulk import evaluate_bulk, to_csv, to_table
+from inference import load_ner_pipeline, VERIFY_SAMPLES
+from model_registry import models, warmup_names_from_env
+from jobs import JobStore, TooManyJobs
+from sessions import SessionStore
+from uploads import (
+    BodyTooLarge, RequestBodyLimit, UploadSpool, UploadTooLarge, TooManyPages, UploadBudgetExceeded, open_pdf,
+)
+from medical_analyzer import MedicalReportAnalyzer
+from medical_chat import MedicalChatAnalyzer
+from metrics import render as render_metrics, record_error, server_timing, span, start_profile, timed
+from pydantic import BaseModel
 
 app = FastAPI()
 
+# CPU-bound stages (pdfplumber, NER) run here so they never block the event loop
+executor = AnalysisExecutor.from_env()
+
+# Repeat uploads of the same PDF are answered from here
+result_cache = ResultCache.from_env()
+
+# Uploads are read from Starlette's spool in place and admitted against a global byte budget
+uploads = UploadSpool.from_env(portable=executor.kind == "process")
+# Routes that take exactly one PDF, and the room allowed for multipart framing around it
+SINGLE_UPLOAD_ROUTES = {"/api/analyze-report", "/api/analyze-report/stream", "/api/medical-report-jobs"}
+MULTIPART_OVERHEAD = 64 * 1024
+# What /api/analyze-report echoes of the extracted text: full, none or gzip (base64)
+RESPONSE_TEXT = os.environ.get("RESPONSE_TEXT", "full")
+# Files of one bulk request on the pool at once, so a large batch can't crowd out other requests
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", str(max(1, executor.max_workers // 2))))
+# Upper bound on a bulk request's deadline, however many files it has
+BULK_MAX_TIMEOUT = float(os.environ.get("BULK_MAX_TIMEOUT", "1800"))
+
+# Per-job progress for long-running LLM analyses. With STATE_DIR set, jobs and
+# chat sessions are also kept on disk so every worker can serve them; the store
+# calls that may touch the disk run on a thread
+jobs = JobStore.from_env()
+job_tasks = set()
+report_analyzer = MedicalReportAnalyzer()
+chat_analyzer = MedicalChatAnalyzer()
+
+# Reports registered for chat, already split, indexed and tokenized
+chat_sessions = SessionStore.from_env()
+# Questions per request; each becomes CHAT_RETRIEVAL_TOP_K rows of one QA forward pass
+CHAT_MAX_QUESTIONS = int(os.environ.get("CHAT_MAX_QUESTIONS", "16"))
+
+class ChatWithReportRequest(BaseModel):
+    text: str
+    question: str
+
+class ChatSessionRequest(BaseModel):
+    text: str
+
+class ChatQuestionsRequest(BaseModel):
+    questions: List[str]
+
+def request_body_limit(path):
+    if path in SINGLE_UPLOAD_ROUTES:
+        return uploads.max_bytes + MULTIPART_OVERHEAD
+    return uploads.in_flight_bytes
+
+# Registered before CORS so rejections still carry CORS headers.
+# Bodies that could never be admitted are cut off before Starlette spools them
+app.add_middleware(RequestBodyLimit, limit_for=request_body_limit)
+
+@app.exception_handler(BodyTooLarge)
+async def body_too_large(request: Request, e: BodyTooLarge):
+    return upload_error_response(UploadTooLarge(e.detail))
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    # Opt-in breakdown of where the request's time went: send "X-Profile: 1"
+    if request.headers.get("x-profile") != "1":
+        return await call_next(request)
+    timings = start_profile()
+    start = time.perf_counter()
+    response = await call_next(request)
+    timings.append(("total", time.perf_counter() - start))
+    response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -18,44 +110,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# Initialize model at startup
-print("Loading biomedical NER model...")
+# The model is loaded on first use or by the background warm-up, never at import time
 model_name = "d4data/biomedical-ner-all"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForTokenClassification.from_pretrained(model_name)
-ner_pipeline = pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="simple")
-print("Model loaded successfully")
+
+def load_ner_model():
+    print("Loading biomedical NER model...")
+    ner_pipeline, tokenizer, backend = load_ner_pipeline(model_name)
+    print(f"Model loaded successfully ({backend} backend)")
+    return ner_pipeline, tokenizer, backend
+
+def warm_up_ner_model(ner_model):
+    ner_pipeline, _, _ = ner_model
+    ner_pipeline(VERIFY_SAMPLES[:2], batch_size=2)
+
+models.register("ner", load_ner_model, warm_up_ner_model)
+
+def run_ner_batch(chunks):
+    # The pipeline pads the chunks into a single batch and returns one entity list per chunk
+    ner_pipeline, _, _ = models.get("ner")
+    with span("ner.forward"):
+        return ner_pipeline(chunks, batch_size=len(chunks))
+
+# Chunks from all in-flight requests are merged into shared NER batches
+ner_batcher = MicroBatcher.from_env(run_ner_batch)
 
 def load_reference_ranges():
-    return {
-        "Alanine aminotransferase (ALT)": {"range": (10, 40), "unit": "U/L"},
-        "Albumin": {"range": (3.5, 5), "unit": "g/dL"},
-        "Potassium": {"range": (3.5, 5.0), "unit": "mEq/L"},
-        "Sodium": {"range": (136, 142), "unit": "mEq/L"},
-        "Hemoglobin": {"range": (12, 18), "unit": "g/dL"},
-        "Glucose": {"range": (70, 110), "unit": "mg/dL"},
-        "White Blood Cell (WBC)": {"range": (4.5, 11.0), "unit": "K/µL"},
-        "Red Blood Cell (RBC)": {"range": (4.5, 5.9), "unit": "M/µL"},
-        "Platelet Count": {"range": (150, 450), "unit": "K/µL"},
-        "Total Cholesterol": {"range": (125, 200), "unit": "mg/dL"},
-        "HDL Cholesterol": {"range": (40, 60), "unit": "mg/dL"},
-        "LDL Cholesterol": {"range": (0, 100), "unit": "mg/dL"},
-        "Triglycerides": {"range": (0, 150), "unit": "mg/dL"},
-        "Creatinine": {"range": (0.6, 1.2), "unit": "mg/dL"},
-        "BUN (Blood Urea Nitrogen)": {"range": (7, 20), "unit": "mg/dL"},
-        "AST (Aspartate Aminotransferase)": {"range": (10, 40), "unit": "U/L"},
-        "Alkaline Phosphatase": {"range": (44, 147), "unit": "U/L"},
-        "Total Bilirubin": {"range": (0.3, 1.2), "unit": "mg/dL"},
-        "TSH (Thyroid Stimulating Hormone)": {"range": (0.4, 4.0), "unit": "mIU/L"},
-        "T4 (Thyroxine)": {"range": (4.5, 11.2), "unit": "µg/dL"},
-        "HbA1c (Hemoglobin A1c)": {"range": (4.0, 5.6), "unit": "%"},
-        "Fasting Blood Sugar": {"range": (70, 100), "unit": "mg/dL"},
-        "Calcium": {"range": (8.5, 10.5), "unit": "mg/dL"},
-        "Magnesium": {"range": (1.7, 2.2), "unit": "mg/dL"},
-        "Chloride": {"range": (96, 106), "unit": "mEq/L"},
-    }
+    # The analyte catalog is shared with MedicalReportAnalyzer
+    return reference_ranges()
+
+# Changes whenever the reference table does, invalidating cached evaluations
+REFERENCE_VERSION = make_key(
+    sorted(load_reference_ranges().items()), sorted(reference_aliases().items()), sorted(IGNORED_NAMES)
+)
 
 def load_test_metadata():
     return {
@@ -75,106 +164,165 @@ def load_test_metadata():
         }
     }
 
-def extract_text_from_pdf(file_content):
-    with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-        return "\n".join(page.extract_text() for page in pdf.pages)
+# Built once; matching a test name no longer rescans the whole reference table
+reference_index = ReferenceRangeIndex.build(
+    load_reference_ranges(), load_test_metadata(), reference_aliases(), IGNORED_NAMES
+)
+
+def iter_pdf_pages(source):
+    # source is the PDF bytes or the path of a spooled upload
+    with open_pdf(source, uploads.max_pages) as pdf:
+        for page in pdf.pages:
+            yield page.extract_text() or ""
+
+@timed("extract")
+def extract_pdf_pages(source):
+    return list(iter_pdf_pages(source))
+
+@timed("extract")
+def extract_text_from_pdf(source):
+    return "\n".join(iter_pdf_pages(source))
+
+NER_MAX_TOKENS = int(os.environ.get("NER_MAX_TOKENS", "512"))
+NER_STRIDE = int(os.environ.get("NER_STRIDE", "64"))
+# Reports where the lab scanner finds this many distinct analytes skip NER (0 disables)
+LAB_SCAN_MIN_ANALYTES = int(os.environ.get("LAB_SCAN_MIN_ANALYTES", "5"))
+
+def scan_lab_values(text, min_analytes=LAB_SCAN_MIN_ANALYTES):
+    """Entities from the regex lab scanner, or None if the text isn't structured enough"""
+    if min_analytes <= 0:
+        return None
+    readings = scanner.scan(text)
+    if len({reading["analyte"] for reading in readings}) < min_analytes:
+        return None
+    return readings_to_entities(readings)
+
+def analyze_text(text, max_tokens=NER_MAX_TOKENS, stride=NER_STRIDE):
+    # Well-structured lab reports are fully covered by the scanner
+    with span("lab_scan"):
+        entities = scan_lab_values(text)
+    if entities is not None:
+        return entities
+
+    _, tokenizer, _ = models.get("ner")
+    with span("chunking"):
+        windows = chunk_text(text, tokenizer, max_tokens=max_tokens, stride=stride)
+    with span("ner"):
+        window_entities = ner_batcher.run([window for _, window in windows])
+    return merge_entities(windows, window_entities)
+
+def ner_version():
+    # Keyed on the backend that actually loaded: a quantized backend that fails
+    # verification falls back to fp32, and its entities must not be cached as int8/onnx
+    _, _, backend = models.get("ner")
+    return make_key(model_name, backend, NER_MAX_TOKENS, NER_STRIDE, LAB_SCAN_MIN_ANALYTES, REFERENCE_VERSION)
+
+async def current_ner_version():
+    # The first call may load the model, which must not block the event loop
+    if models.is_loaded("ner"):
+        return ner_version()
+    return await asyncio.to_thread(ner_version)
+
+def evaluation_cache_key(digest, version, mode="document"):
+    # The stream scans and runs NER page by page, which can find different tests
+    # than the whole-document path, so each mode caches its own evaluation
+    return make_key(digest, version, REFERENCE_VERSION, mode)
+
+class TestAssembler:
+    """Groups a stream of NER entities into tests.
+
+    A test is only complete once the next one starts, so the last test of a
+    page stays open until more entities arrive or finish() is called.
+    """
+
+    def __init__(self):
+        self._test = {}
 
-def analyze_text(text, batch_size=512):
-    chunks = [text[i:i + batch_size] for i in range(0, len(text), batch_size)]
-    return [entity for chunk in chunks for entity in ner_pipeline(chunk)]
+    def feed(self, ner_results):
+        tests = []
+        for entity in ner_results:
+            if entity["entity_group"] == "Diagnostic_procedure":
+                if self._test:
+                    tests.append(self._test)
+                self._test = {"Test Name": entity["word"]}
+            elif entity["entity_group"] == "Lab_value":
+                self._test["Value"] = entity["word"]
+            elif entity["entity_group"] == "Unit":
+                self._test["Unit"] = entity["word"]
+        return tests
 
+    def finish(self):
+        test, self._test = self._test, {}
+        return [test] if test else []
+
+@timed("simplify")
 def simplify_results(ner_results):
-    tests = []
-    test = {}
-
-    for entity in ner_results:
-        if entity["entity_group"] == "Diagnostic_procedure":
-            if test:
-                tests.append(test)
-            test = {"Test Name": entity["word"]}
-        elif entity["entity_group"] == "Lab_value":
-            test["Value"] = entity["word"]
-        elif entity["entity_group"] == "Unit":
-            test["Unit"] = entity["word"]
-    if test:
-        tests.append(test)
-    return tests
-
-def find_closest_match(name, reference_ranges):
-    # Convert to lowercase and remove common words/characters for better matching
-    def clean_name(n):
-        return n.lower().replace('(', '').replace(')', '').replace(',', '').strip()
-    
-    name = clean_name(name)
-    matches = {}
-    
-    for ref_name in reference_ranges.keys():
-        ref_clean = clean_name(ref_name)
-        # Check for exact match
-        if name == ref_clean:
-            return ref_name
-        # Check if name is contained in reference name
-        if name in ref_clean or ref_clean in name:
-            matches[ref_name] = len(ref_clean)
-    
-    # Return the closest match if any found
-    if matches:
-        return max(matches.items(), key=lambda x: x[1])[0]
-    
-    # Try fuzzy matching if no direct match found
-    close_matches = get_close_matches(name, 
-                                    [clean_name(k) for k in reference_ranges.keys()], 
-                                    n=1, 
-                                    cutoff=0.6)
-    
-    # Return the first match if found, otherwise return None
-    return reference_ranges.keys()[0] if close_matches else None
+    assembler = TestAssembler()
+    return assembler.feed(ner_results) + assembler.finish()
+
+@timed("match")
+def find_closest_match(name, reference_index):
+    return reference_index.match(name)
+
+def evaluate_test(test, reference_index):
+    """Returns ("abnormal" | "normal", entry), or None if the test can't be evaluated"""
+    name = test.get("Test Name", "").strip()
+    value = test.get("Value", "").strip()
+    unit = test.get("Unit", "").strip()
 
-def evaluate_tests(tests, reference_ranges):
+    reference_ranges = reference_index.ranges
+    matched_name = find_closest_match(name, reference_index)
+    if not (matched_name and matched_name in reference_ranges):
+        print(f"No reference range found for test: {name}")
+        return None
+
+    ref_range = reference_ranges[matched_name]["range"]
+    ref_unit = reference_ranges[matched_name]["unit"]
+
+    try:
+        values = list(map(float, re.findall(r"[-+]?\d*\.\d+|\d+", value)))
+        if values:
+            if len(values) == 1 and not (ref_range[0] <= values[0] <= ref_range[1]):
+                return "abnormal", {
+                    "test": name,
+                    "value": value,
+                    "unit": unit,
+                    "range": f"{ref_range[0]}-{ref_range[1]} {ref_unit}"
+                }
+            elif len(values) == 2 and not (ref_range[0] <= values[0] <= ref_range[1] and ref_range[0] <= values[1] <= ref_range[1]):
+                return "abnormal", {
+                    "test": name,
+                    "value": f"{values[0]}-{values[1]}",
+                    "unit": unit,
+                    "range": f"{ref_range[0]}-{ref_range[1]} {ref_unit}"
+                }
+            else:
+                return "normal", {
+                    "test": name,
+                    "value": value,
+                    "unit": unit,
+                    "range": f"{ref_range[0]}-{ref_range[1]} {ref_unit}"
+                }
+    except ValueError:
+        print(f"Error parsing value for {name}: {value}")
+    return None
+
+@timed("evaluate")
+def evaluate_tests(tests, reference_index):
     status = "Good"
     abnormal_tests = []
     normal_tests = []
 
     for test in tests:
-        name = test.get("Test Name", "").strip()
-        value = test.get("Value", "").strip()
-        unit = test.get("Unit", "").strip()
-        
-        matched_name = find_closest_match(name, reference_ranges)
-        if matched_name and matched_name in reference_ranges:
-            ref_range = reference_ranges[matched_name]["range"]
-            ref_unit = reference_ranges[matched_name]["unit"]
-
-            try:
-                values = list(map(float, re.findall(r"[-+]?\d*\.\d+|\d+", value)))
-                if values:
-                    if len(values) == 1 and not (ref_range[0] <= values[0] <= ref_range[1]):
-                        status = "Bad"
-                        abnormal_tests.append({
-                            "test": name,
-                            "value": value,
-                            "unit": unit,
-                            "range": f"{ref_range[0]}-{ref_range[1]} {ref_unit}"
-                        })
-                    elif len(values) == 2 and not (ref_range[0] <= values[0] <= ref_range[1] and ref_range[0] <= values[1] <= ref_range[1]):
-                        status = "Bad"
-                        abnormal_tests.append({
-                            "test": name,
-                            "value": f"{values[0]}-{values[1]}",
-                            "unit": unit,
-                            "range": f"{ref_range[0]}-{ref_range[1]} {ref_unit}"
-                        })
-                    else:
-                        normal_tests.append({
-                            "test": name,
-                            "value": value,
-                            "unit": unit,
-                            "range": f"{ref_range[0]}-{ref_range[1]} {ref_unit}"
-                        })
-            except ValueError:
-                print(f"Error parsing value for {name}: {value}")
+        evaluated = evaluate_test(test, reference_index)
+        if evaluated is None:
+            continue
+        kind, entry = evaluated
+        if kind == "abnormal":
+            status = "Bad"
+            abnormal_tests.append(entry)
         else:
-            print(f"No reference range found for test: {name}")
+            normal_tests.append(entry)
 
     return {
         "status": status,
@@ -182,40 +330,476 @@ def evaluate_tests(tests, reference_ranges):
         "normal_tests": normal_tests
     }
 
-@app.post("/api/analyze-report")
-async def analyze_report(file: UploadFile = File(...)):
-    try:
-        contents = await file.read()
-        
-        # Extract text from PDF
-        text = extract_text_from_pdf(contents)
-        
-        # Analyze with NER
+def extract_tests(source, digest=None):
+    """Synchronous extraction + NER for one PDF, reusing cached layers"""
+    digest = digest or content_digest(source)
+    text = result_cache.get("text", digest)
+    if text is None:
+        text = extract_text_from_pdf(source)
+        result_cache.put("text", digest, text)
+
+    entities_key = make_key(digest, ner_version())
+    ner_results = result_cache.get("entities", entities_key)
+    if ner_results is None:
         ner_results = analyze_text(text)
-        
-        # Simplify results
-        tests = simplify_results(ner_results)
-        
-        # Load reference ranges
-        reference_ranges = load_reference_ranges()
-        
-        # Evaluate test results
-        evaluation = evaluate_tests(tests, reference_ranges)
-        
+        result_cache.put("entities", entities_key, ner_results)
+
+    return simplify_results(ner_results)
+
+def busy_response():
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": "5"},
+        content={"success": False, "error": "Server is busy, please retry shortly"}
+    )
+
+def timeout_response():
+    return JSONResponse(
+        status_code=503,
+        content={"success": False, "error": "Analysis timed out"}
+    )
+
+def upload_error_response(e):
+    record_error("upload", e)
+    if isinstance(e, UploadBudgetExceeded):
+        print(f"Rejected upload: {str(e)}")
+        return busy_response()
+    return JSONResponse(status_code=413, content={"success": False, "error": str(e)})
+
+UPLOAD_ERRORS = (UploadTooLarge, TooManyPages, UploadBudgetExceeded)
+
+def text_fields(text, mode):
+    """The extracted text as echoed in a response: in full, omitted, or gzipped"""
+    if mode == "none":
+        return {}
+    if mode == "gzip":
+        compressed = gzip.compress(text.encode("utf-8"))
+        return {"text": base64.b64encode(compressed).decode("ascii"), "text_encoding": "gzip+base64"}
+    return {"text": text}
+
+async def evaluate_upload(upload, include_text):
+    """Cache lookup, extraction, NER and evaluation for one received upload"""
+    digest = upload.digest
+    version = await current_ner_version()
+    entities_key = make_key(digest, version)
+    evaluation_key = evaluation_cache_key(digest, version)
+
+    text = await result_cache.aget("text", digest)
+    cached = await result_cache.aget("evaluation", evaluation_key) if text is not None else None
+    if cached is not None:
         return {
             "success": True,
-            "text": text,
-            "results": tests,
-            "evaluation": evaluation
+            **text_fields(text, include_text),
+            "results": cached["results"],
+            "evaluation": cached["evaluation"]
         }
-        
+
+    ner_results = await result_cache.aget("entities", entities_key)
+    if text is None or ner_results is None:
+        async with executor.admit() as job:
+            if text is None:
+                # Extract text from PDF
+                text = await job.run(extract_text_from_pdf, upload.source)
+                await result_cache.aput("text", digest, text)
+
+            if ner_results is None:
+                # Analyze with NER
+                ner_results = await job.run(analyze_text, text)
+                await result_cache.aput("entities", entities_key, ner_results)
+
+    # Simplify results
+    tests = simplify_results(ner_results)
+    
+    # Evaluate test results
+    evaluation = evaluate_tests(tests, reference_index)
+    await result_cache.aput("evaluation", evaluation_key, {"results": tests, "evaluation": evaluation})
+    
+    return {
+        "success": True,
+        **text_fields(text, include_text),
+        "results": tests,
+        "evaluation": evaluation
+    }
+
+@app.post("/api/analyze-report")
+async def analyze_report(file: UploadFile = File(...), include_text: str = RESPONSE_TEXT):
+    """Extracts and evaluates a report; include_text=none|gzip trims the echoed text"""
+    if include_text not in ("full", "none", "gzip"):
+        return JSONResponse(status_code=400, content={"success": False, "error": "include_text must be full, none or gzip"})
+
+    try:
+        async with uploads.receive(file) as upload:
+            return await evaluate_upload(upload, include_text)
+    except UPLOAD_ERRORS as e:
+        return upload_error_response(e)
+    except ExecutorSaturated as e:
+        print(f"Rejected: {str(e)}")
+        record_error("analyze-report", e)
+        return busy_response()
+    except ExecutorTimeout as e:
+        print(f"Timeout: {str(e)}")
+        record_error("analyze-report", e)
+        return timeout_response()
     except Exception as e:
         print(f"Error: {str(e)}")
+        record_error("analyze-report", e)
         return {
             "success": False,
             "error": str(e)
         }
 
+@app.post("/api/analyze-reports")
+async def analyze_reports(files: List[UploadFile] = File(...), format: str = "csv"):
+    """Analyzes many reports at once and returns one row per test (CSV, or format=json).
+
+    A file that can't be analyzed gets a single row with status "error" instead
+    of failing the whole batch.
+    """
+    if format not in ("csv", "json"):
+        return JSONResponse(status_code=400, content={"success": False, "error": "format must be csv or json"})
+
+    slots = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def analyze_upload(job, file):
+        try:
+            async with slots, uploads.receive(file) as upload:
+                return file.filename, await job.run(extract_tests, upload.source, upload.digest), None
+        except UploadBudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error analyzing {file.filename}: {str(e)}")
+            record_error("analyze-reports", e)
+            return file.filename, [], str(e) or type(e).__name__
+
+    try:
+        # One admission for the whole batch; at most BULK_CONCURRENCY of its files are on the
+        # pool at once. The deadline allows one full timeout per wave, up to BULK_MAX_TIMEOUT
+        waves = math.ceil(len(files) / BULK_CONCURRENCY)
+        timeout = min(executor.timeout * waves, BULK_MAX_TIMEOUT)
+        async with executor.admit(timeout=timeout) as job:
+            results = await asyncio.gather(*(analyze_upload(job, upload) for upload in files))
+
+        reports = [(name, tests) for name, tests, error in results if error is None]
+        errors = [(name, error) for name, _, error in results if error is not None]
+        columns = evaluate_bulk(reports, reference_index, errors)
+        if format == "json":
+            return {"success": True, "failed": len(errors), **to_table(columns)}
+        return Response(content=to_csv(columns), media_type="text/csv")
+
+    except UPLOAD_ERRORS as e:
+        return upload_error_response(e)
+    except ExecutorSaturated as e:
+        print(f"Rejected: {str(e)}")
+        record_error("analyze-reports", e)
+        return busy_response()
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        record_error("analyze-reports", e)
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+def format_event(event, stream_format):
+    if stream_format == "sse":
+        return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    return json.dumps(event) + "\n"
+
+async def stream_analysis(job, upload, evaluation_key):
+    """Yields page, test and completion events while later pages are still being processed"""
+    assembler = TestAssembler()
+    tests = []
+    evaluation = {"status": "Good", "abnormal_tests": [], "normal_tests": []}
+    pages_text = []
+
+    def emit_tests(completed):
+        events = []
+        for test in completed:
+            tests.append(test)
+            evaluated = evaluate_test(test, reference_index)
+            if evaluated is None:
+                continue
+            kind, entry = evaluated
+            if kind == "abnormal":
+                evaluation["status"] = "Bad"
+            evaluation[f"{kind}_tests"].append(entry)
+            events.append({"type": "test", "status": kind, **entry})
+        return events
+
+    pending = None
+    page_number = 0
+    try:
+        if executor.kind == "process":
+            # Generators can't cross a process boundary, so extract every page up front
+            extracted = iter(await job.run(extract_pdf_pages, upload.source))
+            async def next_page():
+                return next(extracted, None)
+        else:
+            pages = iter_pdf_pages(upload.source)
+            async def next_page():
+                return await job.run(next, pages, None)
+
+        pending = asyncio.ensure_future(next_page())
+        while True:
+            page, pending = await pending, None
+            if page is None:
+                break
+            page_number += 1
+            pages_text.append(page)
+            # Extract the following page while this one goes through NER
+            pending = asyncio.ensure_future(next_page())
+            yield {"type": "page", "page": page_number}
+
+            ner_results = await job.run(analyze_text, page)
+            for event in emit_tests(assembler.feed(ner_results)):
+                yield event
+
+        for event in emit_tests(assembler.finish()):
+            yield event
+
+        await result_cache.aput("text", upload.digest, "\n".join(pages_text))
+        await result_cache.aput("evaluation", evaluation_key, {"results": tests, "evaluation": evaluation})
+        yield {"type": "complete", "pages": page_number, "results": tests, **evaluation}
+    finally:
+        if pending is not None:
+            pending.cancel()
+        job.close()
+
+async def replay_cached_analysis(cached):
+    evaluation = cached["evaluation"]
+    for kind in ("abnormal", "normal"):
+        for entry in evaluation[f"{kind}_tests"]:
+            yield {"type": "test", "status": kind, **entry}
+    yield {"type": "complete", "cached": True, "results": cached["results"], **evaluation}
+
+@app.post("/api/analyze-report/stream")
+async def analyze_report_stream(file: UploadFile = File(...), format: str = "ndjson"):
+    """Streams each evaluated test as NDJSON (default) or Server-Sent Events (format=sse)"""
+    if format not in ("ndjson", "sse"):
+        return JSONResponse(status_code=400, content={"success": False, "error": "format must be ndjson or sse"})
+
+    # The spooled upload has to outlive this handler, until the stream is done
+    upload_scope = AsyncExitStack()
+    try:
+        upload = await upload_scope.enter_async_context(uploads.receive(file))
+    except UPLOAD_ERRORS as e:
+        return upload_error_response(e)
+    evaluation_key = evaluation_cache_key(upload.digest, await current_ner_version(), "pages")
+
+    cached = await result_cache.aget("evaluation", evaluation_key)
+    if cached is not None:
+        await upload_scope.aclose()
+        events = replay_cached_analysis(cached)
+        background = None
+    else:
+        try:
+            job = executor.open_job()
+        except ExecutorSaturated as e:
+            print(f"Rejected: {str(e)}")
+            record_error("analyze-report-stream", e)
+            await upload_scope.aclose()
+            return busy_response()
+        events = stream_analysis(job, upload, evaluation_key)
+
+        async def release():
+            job.close()
+            await upload_scope.aclose()
+
+        # Releases the slot and the upload even if the client disconnects before the stream starts
+        background = BackgroundTask(release)
+
+    async def body():
+        try:
+            async for event in events:
+                yield format_event(event, format)
+        except Exception as e:
+            print(f"Stream error: {str(e)}")
+            record_error("analyze-report-stream", e)
+            yield format_event({"type": "error", "error": str(e)}, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, background=background)
+
+async def run_report_job(job, upload, upload_scope):
+    try:
+        jobs.update(job, status="running", stage="reading", percent=0)
+        async with upload_scope, executor.admit() as slot:
+            text = await slot.run(extract_text_from_pdf, upload.source)
+        jobs.update(job, stage="reading", percent=10)
+
+        analysis = await report_analyzer.analyze(text, on_progress=jobs.progress_callback(job))
+        if "error" in analysis:
+            jobs.update(job, status="error", error=analysis["error"], result=analysis)
+        else:
+            jobs.update(job, status="complete", stage="complete", percent=100, result=analysis)
+    except ExecutorSaturated as e:
+        record_error("report-job", e)
+        jobs.update(job, status="error", error=f"Server is busy: {str(e)}")
+    except Exception as e:
+        print(f"Job {job.id} failed: {str(e)}")
+        record_error("report-job", e)
+        jobs.update(job, status="error", error=str(e))
+
+@app.post("/api/medical-report-jobs", status_code=202)
+async def create_report_job(file: UploadFile = File(...)):
+    """Starts an LLM report analysis; poll the status URL or follow the events URL for progress"""
+    # Handed over to the job, which releases the upload once the text is extracted
+    upload_scope = AsyncExitStack()
+    try:
+        upload = await upload_scope.enter_async_context(uploads.receive(file))
+    except UPLOAD_ERRORS as e:
+        return upload_error_response(e)
+
+    try:
+        job = await asyncio.to_thread(jobs.create)
+    except TooManyJobs as e:
+        print(f"Rejected: {str(e)}")
+        record_error("report-job", e)
+        await upload_scope.aclose()
+        return busy_response()
+
+    # Hold a reference so the task isn't garbage-collected mid-run
+    task = asyncio.create_task(run_report_job(job, upload, upload_scope))
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+    return {
+        "success": True,
+        "job_id": job.id,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events"
+    }
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(jobs.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "Unknown job"})
+    return job.snapshot()
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events stream with one event per stage, ending when the job finishes"""
+    job = await asyncio.to_thread(jobs.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "Unknown job"})
+
+    async def body():
+        async for snapshot in jobs.subscribe(job):
+            yield format_event({"type": snapshot["status"], **snapshot}, "sse")
+
+    return StreamingResponse(body(), media_type="text/event-stream")
+
+def answer_question(text, question):
+    # Module-level so it can also be sent to a process pool
+    return chat_analyzer.chat_with_report(text, question)
+
+@app.post("/api/chat-with-report")
+async def chat_with_report(request: ChatWithReportRequest):
+    """Answers a question from the report passages most relevant to it"""
+    try:
+        async with executor.admit() as job:
+            response = await job.run(answer_question, request.text, request.question)
+        return {"success": "error" not in response, "response": response}
+    except ExecutorSaturated as e:
+        print(f"Rejected: {str(e)}")
+        record_error("chat-with-report", e)
+        return busy_response()
+    except ExecutorTimeout as e:
+        print(f"Timeout: {str(e)}")
+        record_error("chat-with-report", e)
+        return timeout_response()
+
+def prepare_chat_report(text):
+    return chat_analyzer.prepare_report(text)
+
+def answer_chat_questions(report, questions):
+    return chat_analyzer.ask(report, questions)
+
+def session_not_found():
+    return JSONResponse(status_code=404, content={"success": False, "error": "Chat session not found or expired"})
+
+@app.post("/api/chat-sessions")
+async def create_chat_session(request: ChatSessionRequest):
+    """Registers a report once; follow-up questions only send the session id"""
+    try:
+        async with executor.admit() as job:
+            report = await job.run(prepare_chat_report, request.text)
+        return {
+            "success": True,
+            "session_id": await asyncio.to_thread(chat_sessions.create, report),
+            "passages": len(report.passages)
+        }
+    except ExecutorSaturated as e:
+        print(f"Rejected: {str(e)}")
+        record_error("chat-session", e)
+        return busy_response()
+    except ExecutorTimeout as e:
+        print(f"Timeout: {str(e)}")
+        record_error("chat-session", e)
+        return timeout_response()
+    except Exception as e:
+        print(f"Error creating chat session: {str(e)}")
+        record_error("chat-session", e)
+        return {"success": False, "error": str(e)}
+
+@app.post("/api/chat-sessions/{session_id}/questions")
+async def ask_chat_session(session_id: str, request: ChatQuestionsRequest):
+    """Answers all questions about a registered report in one batch"""
+    report = await asyncio.to_thread(chat_sessions.get, session_id)
+    if report is None:
+        return session_not_found()
+    if not request.questions:
+        return {"success": True, "responses": []}
+    if len(request.questions) > CHAT_MAX_QUESTIONS:
+        return JSONResponse(
+            status_code=413,
+            content={"success": False, "error": f"At most {CHAT_MAX_QUESTIONS} questions per request"}
+        )
+    try:
+        async with executor.admit() as job:
+            responses = await job.run(answer_chat_questions, report, request.questions)
+        return {
+            "success": not any("error" in response for response in responses),
+            "responses": responses
+        }
+    except ExecutorSaturated as e:
+        print(f"Rejected: {str(e)}")
+        record_error("chat-questions", e)
+        return busy_response()
+    except ExecutorTimeout as e:
+        print(f"Timeout: {str(e)}")
+        record_error("chat-questions", e)
+        return timeout_response()
+
+@app.delete("/api/chat-sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    if not await asyncio.to_thread(chat_sessions.delete, session_id):
+        return session_not_found()
+    return {"success": True}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for every worker: stage latencies, queues, cache, tokens and errors"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    body = {"ready": models.ready, "models": models.status()}
+    return JSONResponse(status_code=200 if models.ready else 503, content=body)
+
+@app.on_event("startup")
+def start_model_warmup():
+    models.start_warmup(warmup_names_from_env(["ner"]))
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    executor.shutdown()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
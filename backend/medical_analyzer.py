@@ -1,204 +1,285 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
 import asyncio
+import os
 import re
+from model_registry import models
+from generation import ReportPrefix, generate_with_prefix, next_token_logits, parse_structured_response
+from generation_server import GenerationScheduler
+from analytes import ANALYTES, classify, scanner
+from metrics import GENERATED_TOKENS, record_error, span
+
+LLAMA_MODEL_NAME = "meta-llama/Llama-2-7b-hf"  # or your preferred LLaMA version
+
+# Vocabulary that almost only shows up in lab/clinical documents
+MEDICAL_KEYWORDS = re.compile(
+    r"\b(hemoglobin|haemoglobin|hematocrit|wbc|rbc|platelets?|glucose|hba1c|cholesterol|"
+    r"triglycerides|creatinine|bun|alt|ast|bilirubin|albumin|tsh|sodium|potassium|"
+    r"chloride|calcium|magnesium|reference range|lab(?:oratory)? results?|specimen|"
+    r"patient|diagnosis|physician|mg/dl|g/dl|mmol/l|meq/l|u/l|k/[µu]l)\b",
+    re.IGNORECASE
+)
+
+# Distinct keyword hits needed to accept a document without asking the LLM
+GATE_ACCEPT_HITS = int(os.environ.get("MEDICAL_GATE_ACCEPT_HITS", "3"))
+# Documents shorter than this with no keyword hits are rejected without the LLM
+GATE_REJECT_MAX_WORDS = int(os.environ.get("MEDICAL_GATE_REJECT_MAX_WORDS", "20"))
+
+# With ANALYZER_SINGLE_PASS=1 one structured generation replaces the analysis + recommendations calls
+SINGLE_PASS = os.environ.get("ANALYZER_SINGLE_PASS", "0") == "1"
+
+GENERATION_KWARGS = {"max_new_tokens": 512, "temperature": 0.7, "do_sample": True}
+
+# With LLM_CONTINUOUS_BATCHING=1 concurrent analyses share one running decode batch
+CONTINUOUS_BATCHING = os.environ.get("LLM_CONTINUOUS_BATCHING", "0") == "1"
+
+# Suffixes appended to the shared ReportPrefix
+VALIDATION_PROMPT = "Is the text above a medical report? Answer YES or NO.\nAnswer:"
+
+ANALYSIS_PROMPT = """Analyze this medical report and provide:
+1. Classification (NORMAL or ABNORMAL)
+2. Confidence score (0-1)
+3. Summary
+4. Key medical terms
+
+Format your response as:
+Classification: [NORMAL/ABNORMAL]
+Confidence: [SCORE]
+Summary: [SUMMARY]
+Terms: [TERM1], [TERM2], [TERM3]
+"""
+
+RECOMMENDATIONS_PROMPT = """Based on this medical report analysis:
+- Classification: {classification}
+- Blood test results: {blood_tests}
+- Key terms: {terms}
+
+Provide medical recommendations. Format each recommendation on a new line starting with '-'.
+"""
+
+STRUCTURED_PROMPT = """Analyze this medical report. Blood test results: {blood_tests}
+
+Format your response as:
+Classification: [NORMAL/ABNORMAL]
+Confidence: [SCORE between 0 and 1]
+Summary: [SUMMARY]
+Terms: [TERM1], [TERM2], [TERM3]
+Recommendations:
+- [RECOMMENDATION]
+- [RECOMMENDATION]
+"""
+
+def keyword_hits(text, limit=5000):
+    return {match.lower() for match in MEDICAL_KEYWORDS.findall(text[:limit])}
+
+def answer_token_ids(tokenizer, answers):
+    """Id of the token each spelling of an answer starts with, with and without a leading space.
+
+    SentencePiece may encode " YES" as a bare "▁" followed by "YES"; tokens that
+    decode to whitespace only are skipped, so they never count towards an answer.
+    """
+    ids = set()
+    for answer in answers:
+        for variant in (answer, " " + answer):
+            tokens = tokenizer.encode(variant, add_special_tokens=False)
+            word = next((token for token in tokens if tokenizer.decode([token]).strip()), None)
+            if word is not None and word != tokenizer.unk_token_id:
+                ids.add(word)
+    return ids
+
+def load_llama_model(model_name=LLAMA_MODEL_NAME):
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    print("Loading LLaMA model...")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        torch_dtype=torch.float16,
+        device_map="auto",
+        low_cpu_mem_usage=True
+    )
+    print("LLaMA model loaded successfully")
+    return model, tokenizer
+
+def warm_up_llama_model(llama_model):
+    import torch
+
+    model, tokenizer = llama_model
+    inputs = tokenizer("Medical report:", return_tensors="pt").to(model.device)
+    with torch.no_grad():
+        model(**inputs)
+
+def load_llama_scheduler():
+    model, tokenizer = models.get("llama")
+    return GenerationScheduler.from_env(model, eos_token_id=tokenizer.eos_token_id)
 
 class MedicalReportAnalyzer:
     def __init__(self):
-        # Initialize LLaMA model
-        print("Loading LLaMA model...")
-        self.model_name = "meta-llama/Llama-2-7b-hf"  # or your preferred LLaMA version
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
-            torch_dtype=torch.float16,
-            device_map="auto",
-            low_cpu_mem_usage=True
-        )
-        print("LLaMA model loaded successfully")
-
-        self.current_progress = 0
-        self.blood_test_ranges = {
-            "hemoglobin": {"min": 13.5, "max": 17.5, "unit": "g/dL"},
-            "wbc": {"min": 4000, "max": 11000, "unit": "/µL"},
-            "rbc": {"min": 4.5, "max": 5.9, "unit": "million/µL"},
-            "platelets": {"min": 150000, "max": 450000, "unit": "/µL"},
-        }
-
-    async def _generate_llama_response(self, prompt):
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
-        outputs = self.model.generate(
-            **inputs,
-            max_new_tokens=512,
-            temperature=0.7,
-            do_sample=True
-        )
-        return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-
-    async def analyze(self, text):
+        # LLaMA is registered here but only loaded on first use (or by the warm-up)
+        self.model_name = LLAMA_MODEL_NAME
+        models.register("llama", lambda: load_llama_model(self.model_name), warm_up_llama_model)
+        models.register("llama-scheduler", load_llama_scheduler)
+
+    @property
+    def model(self):
+        return models.get("llama")[0]
+
+    @property
+    def tokenizer(self):
+        return models.get("llama")[1]
+
+    async def _generate_llama_response(self, prompt, prefix=None):
+        """Generates a reply, decoding only the new tokens; reuses the report prefix's KV cache if given"""
+        if CONTINUOUS_BATCHING:
+            return await self._generate_batched(prompt, prefix)
+
+        def run():
+            if prefix is not None:
+                return generate_with_prefix(
+                    self.model, self.tokenizer, prefix, prompt, **GENERATION_KWARGS
+                )
+            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+            outputs = self.model.generate(**inputs, **GENERATION_KWARGS)
+            new_tokens = outputs[0, inputs["input_ids"].shape[1]:]
+            GENERATED_TOKENS.inc(len(new_tokens))
+            return self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+
+        with span("llm.generate"):
+            return await asyncio.to_thread(run)
+
+    async def _generate_batched(self, prompt, prefix=None):
+        scheduler = await asyncio.to_thread(models.get, "llama-scheduler")
+        tokenizer = self.tokenizer
+        if prefix is not None:
+            await asyncio.to_thread(prefix.encode, self.model, tokenizer)
+            input_ids = tokenizer(prompt, add_special_tokens=False).input_ids
+            shared = (prefix.input_ids[0].tolist(), prefix.past_key_values)
+        else:
+            input_ids = tokenizer(prompt).input_ids
+            shared = None
+
+        with span("llm.generate"):
+            tokens = await scheduler.generate(input_ids, prefix=shared, **GENERATION_KWARGS)
+        return tokenizer.decode(tokens, skip_special_tokens=True)
+
+    def _score_yes(self, prefix):
+        """Probability of YES vs NO as the next token, from a single forward pass"""
+        import torch
+
+        tokenizer, model = self.tokenizer, self.model
+        yes_ids = answer_token_ids(tokenizer, ("YES", "Yes", "yes"))
+        no_ids = answer_token_ids(tokenizer, ("NO", "No", "no")) - yes_ids
+
+        with span("llm.validate"):
+            logits = next_token_logits(model, tokenizer, prefix, VALIDATION_PROMPT).float()
+        yes = torch.logsumexp(logits[list(yes_ids)], dim=0)
+        no = torch.logsumexp(logits[list(no_ids)], dim=0)
+        return torch.sigmoid(yes - no).item()
+
+    async def _is_medical_report(self, text, prefix, readings=()):
+        """Returns (is_medical, method); only consults LLaMA when the keywords are inconclusive"""
+        hits = keyword_hits(text) | {reading["analyte"] for reading in readings}
+        if len(hits) >= GATE_ACCEPT_HITS:
+            return True, "keywords"
+        if not hits and len(text.split()) < GATE_REJECT_MAX_WORDS:
+            return False, "keywords"
+
+        p_yes = await asyncio.to_thread(self._score_yes, prefix)
+        return p_yes >= 0.5, "llm"
+
+    async def analyze(self, text, on_progress=None):
+        """Runs the full analysis; on_progress(stage, percent) is called as each stage completes"""
+        progress = {"status": "Starting", "percent": 0}
+
+        def advance(stage, percent):
+            progress.update(status=stage, percent=percent)
+            if on_progress is not None:
+                on_progress(stage, percent)
+
         try:
-            self.current_progress = 0
-            
+            # Every prompt below continues from this prefix, so the report is encoded once
+            prefix = ReportPrefix(text)
+            # One scan finds every lab value; it also counts towards the medical-report gate
+            blood_test_values = self._extract_blood_test_values(text)
+
             # Validate medical content
-            validation_prompt = f"""
-            Analyze if this is a medical report. Text: {text[:500]}...
-            Answer only 'YES' or 'NO'.
-            """
-            is_medical = await self._generate_llama_response(validation_prompt)
-            await self._update_progress(20, 1)
+            is_medical, _ = await self._is_medical_report(text, prefix, blood_test_values)
+            advance("validation", 20)
             
-            if "NO" in is_medical.upper():
+            if not is_medical:
                 return {
                     "error": "This document doesn't appear to be a medical report",
                     "is_medical_report": False,
-                    "progress": {"status": "Not a medical report", "percent": self.current_progress}
+                    "progress": {"status": "Not a medical report", "percent": progress["percent"]}
                 }
 
-            # Extract blood test values
-            blood_test_values = self._extract_blood_test_values(text)
             blood_test_analysis = self._analyze_blood_tests(blood_test_values)
-            await self._update_progress(40, 1)
+            advance("extraction", 40)
 
-            # Generate classification and analysis
-            analysis_prompt = f"""
-            Analyze this medical report and provide:
-            1. Classification (NORMAL or ABNORMAL)
-            2. Confidence score (0-1)
-            3. Summary
-            4. Key medical terms
+            if SINGLE_PASS:
+                # Classification, summary, terms and recommendations in one generation
+                response = await self._generate_llama_response(
+                    STRUCTURED_PROMPT.format(blood_tests=blood_test_analysis), prefix
+                )
+                parsed = parse_structured_response(response)
+                advance("classification", 70)
+            else:
+                analysis_response = await self._generate_llama_response(ANALYSIS_PROMPT, prefix)
+                parsed = parse_structured_response(analysis_response)
+                advance("classification", 70)
 
-            Report text: {text[:1000]}...
-            
-            Format your response as:
-            Classification: [NORMAL/ABNORMAL]
-            Confidence: [SCORE]
-            Summary: [SUMMARY]
-            Terms: [TERM1], [TERM2], [TERM3]
-            """
-            
-            analysis_response = await self._generate_llama_response(analysis_prompt)
-            await self._update_progress(70, 1)
-
-            # Parse LLaMA's response
-            classification = "ABNORMAL" if "ABNORMAL" in analysis_response else "NORMAL"
-            confidence = 0.8  # Default confidence
-            summary = ""
-            terms = []
-
-            for line in analysis_response.split('\n'):
-                if line.startswith('Summary:'):
-                    summary = line.replace('Summary:', '').strip()
-                elif line.startswith('Terms:'):
-                    terms = [term.strip() for term in line.replace('Terms:', '').split(',')]
-
-            # Generate recommendations
-            recommendations_prompt = f"""
-            Based on this medical report analysis:
-            - Classification: {classification}
-            - Blood test results: {blood_test_analysis}
-            - Key terms: {', '.join(terms)}
-
-            Provide medical recommendations. Format each recommendation on a new line starting with '-'.
-            """
-            
-            recommendations_text = await self._generate_llama_response(recommendations_prompt)
-            recommendations = [
-                rec.strip() for rec in recommendations_text.split('\n') 
-                if rec.strip().startswith('-')
-            ]
-            
-            await self._update_progress(90, 1)
+                recommendations_text = await self._generate_llama_response(
+                    RECOMMENDATIONS_PROMPT.format(
+                        classification=parsed["classification"],
+                        blood_tests=blood_test_analysis,
+                        terms=', '.join(parsed["terms"])
+                    ),
+                    prefix
+                )
+                parsed["recommendations"] = parse_structured_response(recommendations_text)["recommendations"]
+
+            advance("recommendations", 90)
 
             result = {
                 "is_medical_report": True,
                 "text": text,
                 "classification": {
-                    "label": classification,
-                    "confidence": confidence
+                    "label": parsed["classification"],
+                    "confidence": parsed["confidence"]
                 },
-                "entities": [{"text": term, "label": "MEDICAL", "confidence": 0.8} for term in terms],
-                "summary": summary,
+                "entities": [{"text": term, "label": "MEDICAL", "confidence": 0.8} for term in parsed["terms"]],
+                "summary": parsed["summary"],
                 "blood_test_results": blood_test_analysis,
-                "recommendations": recommendations,
+                "recommendations": parsed["recommendations"],
                 "progress": {"status": "Complete", "percent": 100}
             }
 
-            await self._update_progress(100, 1)
+            advance("complete", 100)
             return result
 
         except Exception as e:
             print(f"Analysis error: {str(e)}")
+            record_error("llm.analyze", e)
             return {
                 "error": "Error analyzing the document",
                 "details": str(e),
                 "is_medical_report": False,
-                "progress": {"status": "Error", "percent": self.current_progress}
+                "progress": {"status": "Error", "percent": progress["percent"]}
             }
 
     def _extract_blood_test_values(self, text):
-        """Extract blood test values from text using regex patterns"""
-        blood_test_values = {}
-        
-        # Define patterns for common blood test formats
-        patterns = {
-            "hemoglobin": r"hemoglobin[:\s]+(\d+\.?\d*)",
-            "wbc": r"wbc[:\s]+(\d+,?\d*)",
-            "rbc": r"rbc[:\s]+(\d+\.?\d*)",
-            "platelets": r"platelets[:\s]+(\d+,?\d*)",
-            # Add more patterns as needed
-        }
-        
-        # Extract values using patterns
-        for test, pattern in patterns.items():
-            match = re.search(pattern, text.lower())
-            if match:
-                value = match.group(1).replace(',', '')
-                blood_test_values[test] = float(value)
-        
-        return blood_test_values
-
-    def _analyze_blood_tests(self, values):
+        """Every lab value in the text, in the catalog's reference units"""
+        return scanner.scan(text)
+
+    def _analyze_blood_tests(self, readings):
         """Analyze blood test values against reference ranges"""
         analysis = []
-        
-        for test, value in values.items():
-            if test in self.blood_test_ranges:
-                ref_range = self.blood_test_ranges[test]
-                status = "normal"
-                if value < ref_range["min"]:
-                    status = "low"
-                elif value > ref_range["max"]:
-                    status = "high"
-                
-                analysis.append({
-                    "test": test,
-                    "value": value,
-                    "unit": ref_range["unit"],
-                    "reference_range": f"{ref_range['min']} - {ref_range['max']}",
-                    "status": status
-                })
-        
+        for reading in readings:
+            low, high = ANALYTES[reading["analyte"]]["range"]
+            analysis.append({
+                "test": reading["analyte"],
+                "value": reading["value"],
+                "unit": reading["unit"],
+                "reference_range": f"{low} - {high}",
+                "status": classify(reading)
+            })
         return analysis
-
-    async def _update_progress(self, target_percent, duration):
-        """Smoothly update progress in 0.1% increments"""
-        try:
-            start_percent = self.current_progress
-            steps = int((target_percent - start_percent) * 10)  # 0.1% increments
-            
-            if steps > 0:
-                step_duration = duration / steps
-                for i in range(steps):
-                    self.current_progress = round(start_percent + (i + 1) * 0.1, 1)
-                    await asyncio.sleep(0.1)  # Shorter sleep time to prevent timeout
-                    
-            return {
-                "status": "Processing",
-                "percent": self.current_progress
-            }
-        except Exception as e:
-            print(f"Error updating progress: {str(e)}")
-            return {
-                "status": "Error",
-                "percent": self.current_progress
-            }
\ No newline at end of file
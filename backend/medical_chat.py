@@ -1,71 +1,212 @@
-from transformers import AutoTokenizer, AutoModelForQuestionAnswering, pipeline
-import torch
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from model_registry import models
+from retrieval import BM25Index, split_passages
+from metrics import record_error, span, timed
+
+QA_MODEL_NAME = "samwalton/biobert-base-cased-v1.2"
+
+# Passages handed to the QA model per question
+RETRIEVAL_TOP_K = int(os.environ.get("CHAT_RETRIEVAL_TOP_K", "3"))
+# Reports whose passage index is kept in memory
+INDEX_CACHE_SIZE = int(os.environ.get("CHAT_INDEX_CACHE_SIZE", "128"))
+# Question + passage tokens per QA input, and the longest answer span considered
+QA_MAX_LENGTH = 384
+MAX_ANSWER_TOKENS = 30
+
+def select_device():
+    import torch
+
+    # Check for MPS availability
+    return (
+        "mps" if torch.backends.mps.is_available() 
+        else "cuda" if torch.cuda.is_available() 
+        else "cpu"
+    )
+
+def load_qa_model(model_name=QA_MODEL_NAME):
+    from transformers import AutoTokenizer, AutoModelForQuestionAnswering
+
+    device = select_device()
+    print(f"Using device: {device}")
+
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForQuestionAnswering.from_pretrained(model_name)
+        model = model.to(device)  # Move model to GPU
+        model.eval()
+        
+        print(f"Model loaded successfully on {device}")
+        
+    except Exception as e:
+        print(f"Error loading model: {str(e)}")
+        raise e
+
+    return {"device": device, "tokenizer": tokenizer, "model": model}
+
+def warm_up_qa_model(qa_model):
+    report = PreparedReport("Hemoglobin was 13.5 g/dL.", qa_model["tokenizer"])
+    answer_questions(qa_model, report, ["What was measured?"])
+
+def best_span(start_logits, end_logits, offsets, sequence_ids, context, max_answer_tokens=MAX_ANSWER_TOKENS):
+    """Highest-probability answer span that lies inside the context tokens"""
+    import torch
+
+    in_context = torch.tensor([sid == 1 for sid in sequence_ids], device=start_logits.device)
+    start = start_logits.float().masked_fill(~in_context, float("-inf")).softmax(-1)
+    end = end_logits.float().masked_fill(~in_context, float("-inf")).softmax(-1)
+
+    # scores[i, j] = P(start=i) * P(end=j) for i <= j < i + max_answer_tokens
+    scores = torch.triu(start[:, None] * end[None, :])
+    scores = torch.tril(scores, diagonal=max_answer_tokens - 1)
+    best = int(scores.argmax())
+    first, last = divmod(best, scores.shape[1])
+    char_start, char_end = int(offsets[first][0]), int(offsets[last][1])
+    return {
+        "answer": context[char_start:char_end],
+        "score": float(scores[first, last]),
+        "start": char_start,
+        "end": char_end,
+    }
+
+class PreparedReport:
+    """A report split into passages, BM25-indexed and tokenized once.
+
+    Questions against it only need their own tokens encoded; the passage
+    token ids and offsets are reused for every question.
+    """
+
+    def __init__(self, text, tokenizer):
+        self.passages = split_passages(text) or [text]
+        self.index = BM25Index(self.passages)
+        encoded = tokenizer(self.passages, add_special_tokens=False, return_offsets_mapping=True)
+        self.passage_ids = encoded["input_ids"]
+        self.passage_offsets = encoded["offset_mapping"]
+
+    def retrieve(self, question, top_k=RETRIEVAL_TOP_K):
+        hits = self.index.search(question, k=top_k)
+        # No term overlap with the question; fall back to the start of the report
+        return [i for i, _ in hits] or [0]
+
+def answer_questions(qa_model, report, questions, top_k=RETRIEVAL_TOP_K):
+    """Answers every question in one padded forward pass over its retrieved passages.
+
+    Inputs are assembled from the report's cached passage tokens as
+    [CLS] question [SEP] passage [SEP]; returns the best span per question.
+    """
+    import torch
+
+    tokenizer, model = qa_model["tokenizer"], qa_model["model"]
+    max_length = min(QA_MAX_LENGTH, tokenizer.model_max_length)
+    cls_id, sep_id = tokenizer.cls_token_id, tokenizer.sep_token_id
+    question_ids = tokenizer(list(questions), add_special_tokens=False)["input_ids"]
+
+    rows = []
+    with span("qa.retrieve"):
+        for qi, question in enumerate(questions):
+            q_ids = question_ids[qi][:max_length // 2]
+            for pi in report.retrieve(question, top_k):
+                p_ids = report.passage_ids[pi][:max_length - len(q_ids) - 3]
+                rows.append((qi, pi, [cls_id] + q_ids + [sep_id], p_ids))
+
+    width = max(len(prompt) + len(p_ids) + 1 for _, _, prompt, p_ids in rows)
+    input_ids = torch.full((len(rows), width), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+    token_type_ids = torch.zeros((len(rows), width), dtype=torch.long)
+    for row, (_, _, prompt, p_ids) in enumerate(rows):
+        ids = prompt + p_ids + [sep_id]
+        input_ids[row, :len(ids)] = torch.tensor(ids)
+        attention_mask[row, :len(ids)] = 1
+        token_type_ids[row, len(prompt):len(ids)] = 1
+
+    inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if "token_type_ids" in tokenizer.model_input_names:
+        inputs["token_type_ids"] = token_type_ids
+    with span("qa.forward"), torch.no_grad():
+        outputs = model(**{k: v.to(qa_model["device"]) for k, v in inputs.items()})
+
+    best = [None] * len(questions)
+    for row, (qi, pi, prompt, p_ids) in enumerate(rows):
+        padding = width - len(prompt) - len(p_ids)
+        sequence_ids = [None] * len(prompt) + [1] * len(p_ids) + [None] * padding
+        offsets = [(0, 0)] * len(prompt) + report.passage_offsets[pi][:len(p_ids)] + [(0, 0)] * padding
+        candidate = best_span(
+            outputs.start_logits[row], outputs.end_logits[row], offsets, sequence_ids, report.passages[pi]
+        )
+        if best[qi] is None or candidate["score"] > best[qi][0]["score"]:
+            best[qi] = (candidate, report.passages[pi])
+
+    return [
+        {"answer": answer["answer"], "confidence": answer["score"], "relevant_text": passage}
+        for answer, passage in best
+    ]
 
 class MedicalChatAnalyzer:
     def __init__(self):
-        # Check for MPS availability
-        self.device = (
-            "mps" if torch.backends.mps.is_available() 
-            else "cuda" if torch.cuda.is_available() 
-            else "cpu"
-        )
-        print(f"Using device: {self.device}")
+        # BioBERT is registered here but only loaded on first use (or by the warm-up)
+        self.model_name = QA_MODEL_NAME
+        models.register("biobert-qa", lambda: load_qa_model(self.model_name), warm_up_qa_model)
 
-        self.model_name = "samwalton/biobert-base-cased-v1.2"
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModelForQuestionAnswering.from_pretrained(self.model_name)
-        self.model = self.model.to(self.device)  # Move model to GPU
-        
+        self._reports = OrderedDict()
+        self._reports_lock = threading.Lock()
+
+    @property
+    def device(self):
+        return models.get("biobert-qa")["device"]
+
+    @property
+    def tokenizer(self):
+        return models.get("biobert-qa")["tokenizer"]
+
+    @property
+    def model(self):
+        return models.get("biobert-qa")["model"]
+
+    @timed("qa.prepare")
+    def prepare_report(self, text):
+        """Splits, indexes and tokenizes a report so later questions only encode themselves"""
+        return PreparedReport(text, self.tokenizer)
+
+    def _cached_report(self, text):
+        # Keyed on the content only, so one caller can never be served another's report
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._reports_lock:
+            report = self._reports.get(key)
+            if report is not None:
+                self._reports.move_to_end(key)
+                return report
+
+        report = self.prepare_report(text)
+        with self._reports_lock:
+            self._reports[key] = report
+            while len(self._reports) > INDEX_CACHE_SIZE:
+                self._reports.popitem(last=False)
+        return report
+
+    def ask(self, report, questions):
+        """Answers a list of questions about a prepared report in one batch"""
         try:
-            # Create QA pipeline
-            self.qa_pipeline = pipeline(
-                "question-answering",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                device=0 if self.device == "cuda" else -1
-            )
-            
-            print(f"Model loaded successfully on {self.device}")
-            
+            return answer_questions(models.get("biobert-qa"), report, questions)
         except Exception as e:
-            print(f"Error loading model: {str(e)}")
-            raise e
+            print(f"Error in ask: {str(e)}")
+            record_error("qa.ask", e)
+            return [{"error": "Could not process the question", "details": str(e)} for _ in questions]
 
     def chat_with_report(self, text, question):
         try:
-            # Prepare context by finding relevant section
-            context = self._get_relevant_context(text, question)
-            
-            # Get answer using QA pipeline
-            result = self.qa_pipeline(
-                question=question,
-                context=context,
-            )
-
-            return {
-                "answer": result["answer"],
-                "confidence": result["score"],
-                "relevant_text": context
-            }
+            # Passages are retrieved per question and answered in one batch
+            report = self._cached_report(text)
+            return answer_questions(models.get("biobert-qa"), report, [question])[0]
         except Exception as e:
             print(f"Error in chat_with_report: {str(e)}")
+            record_error("qa.chat", e)
             return {
                 "error": "Could not process the question",
                 "details": str(e)
             }
 
-    def _get_relevant_context(self, text, question, max_length=512):
-        # Simple context window extraction
-        # In a production system, you'd want to use better text chunking and retrieval
-        words = text.split()
-        if len(words) > max_length:
-            # Take first 512 words as context
-            # You could implement more sophisticated context selection here
-            context = ' '.join(words[:max_length])
-        else:
-            context = text
-        return context
-
     def generate_medical_context(self, text):
         medical_terms = self._extract_medical_terms(text)
         return {
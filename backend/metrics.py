@@ -0,0 +1,92 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+
+# Wide enough for both a regex scan and a multi-minute LLM generation
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "analysis_stage_seconds", "Time spent in each pipeline stage and model call",
+    ["stage"], buckets=STAGE_BUCKETS
+)
+# A failure is counted once in each: where it was raised, and where it was handled
+STAGE_ERRORS = Counter("analysis_stage_errors_total", "Exceptions raised inside a stage span", ["stage", "error"])
+ERRORS = Counter("analysis_errors_total", "Errors handled by an endpoint or component", ["where", "error"])
+CACHE_REQUESTS = Counter("result_cache_requests_total", "Result cache lookups", ["layer", "result"])
+# rate() of this is the LLM's tokens per second
+GENERATED_TOKENS = Counter("llm_generated_tokens_total", "Tokens generated by the LLM")
+
+# Gauges are summed over live workers when gunicorn runs several
+EXECUTOR_IN_FLIGHT = Gauge("executor_in_flight", "Requests admitted to the analysis executor", multiprocess_mode="livesum")
+BATCHER_QUEUE_DEPTH = Gauge("ner_batcher_queue_depth", "NER chunks waiting for a batch", multiprocess_mode="livesum")
+SCHEDULER_ACTIVE = Gauge("llm_scheduler_active_sequences", "Sequences in the running decode batch", multiprocess_mode="livesum")
+SCHEDULER_QUEUE_DEPTH = Gauge("llm_scheduler_queue_depth", "Sequences waiting to join the decode batch", multiprocess_mode="livesum")
+UPLOAD_BYTES_IN_FLIGHT = Gauge("upload_bytes_in_flight", "Bytes held by uploads being processed", multiprocess_mode="livesum")
+
+# Per-request (stage, seconds) list, only set while a request is being profiled
+_timings = contextvars.ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def span(stage):
+    """Times a block into the stage histogram (and the request's profile, if one is active)"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.labels(stage, type(e).__name__).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def timed(stage):
+    """Decorator form of span"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_error(where, error):
+    ERRORS.labels(where, type(error).__name__).inc()
+
+
+def start_profile():
+    """Starts collecting stage timings for the current context; returns the list they go into"""
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+def server_timing(timings):
+    """Server-Timing header value, one entry per stage with its total duration in ms"""
+    totals = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items())
+
+
+def render():
+    """Returns (body, content type) for /metrics, merging every worker in multiprocess mode"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
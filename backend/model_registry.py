@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+
+class ModelRegistry:
+    """Loads models on first use instead of at import time.
+
+    Each model is registered with a loader (which should do its own heavy
+    ``torch``/``transformers`` imports) and an optional warm-up callable that
+    runs one inference on the loaded model. ``start_warmup`` loads and warms
+    the configured models on a background thread so the server can accept
+    connections immediately; ``ready`` reports when that has finished.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._warmups = {}
+        self._models = {}
+        self._warm = set()
+        self._errors = {}
+        self._load_times = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.warmup_names = []
+
+    def register(self, name, loader, warmup=None):
+        with self._lock:
+            if name in self._loaders:
+                return
+            self._loaders[name] = loader
+            self._warmups[name] = warmup
+            self._locks[name] = threading.Lock()
+
+    def is_registered(self, name):
+        return name in self._loaders
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._locks[name]:
+            if name not in self._models:
+                start = time.perf_counter()
+                try:
+                    self._models[name] = self._loaders[name]()
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    raise
+                self._errors.pop(name, None)
+                self._load_times[name] = time.perf_counter() - start
+        return self._models[name]
+
+    def warm_up(self, name):
+        model = self.get(name)
+        warmup = self._warmups.get(name)
+        if warmup is not None and name not in self._warm:
+            warmup(model)
+        self._warm.add(name)
+
+    def start_warmup(self, names=None):
+        """Loads and warms models in the background; defaults to every registered model"""
+        self.warmup_names = list(names if names is not None else self._loaders)
+
+        def run():
+            for name in self.warmup_names:
+                try:
+                    print(f"Warming up {name}...")
+                    self.warm_up(name)
+                    print(f"{name} ready")
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    print(f"Warm-up failed for {name}: {str(e)}")
+
+        thread = threading.Thread(target=run, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def ready(self):
+        return all(name in self._warm for name in self.warmup_names)
+
+    def status(self):
+        return {
+            name: {
+                "loaded": name in self._models,
+                "warm": name in self._warm,
+                "load_seconds": self._load_times.get(name),
+                "error": self._errors.get(name),
+            }
+            for name in self._loaders
+        }
+
+
+def warmup_names_from_env(default):
+    """MODEL_WARMUP=0 disables warm-up; WARMUP_MODELS is a comma-separated list of names"""
+    if os.environ.get("MODEL_WARMUP", "1") == "0":
+        return []
+    names = os.environ.get("WARMUP_MODELS")
+    if names is None:
+        return list(default)
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+# Shared by the API and the report/chat analyzers
+models = ModelRegistry()
@@ -0,0 +1,160 @@
+import re
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher, get_close_matches
+from functools import lru_cache
+
+
+def clean_name(name):
+    # Convert to lowercase and remove common words/characters for better matching
+    return name.lower().replace('(', '').replace(')', '').replace(',', '').strip()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Qualifiers shared by many tests; a fuzzy match on these alone says nothing
+GENERIC_WORDS = {"total", "serum", "blood", "plasma", "level", "levels", "count", "test"}
+
+
+def _similar(a, b, cutoff=0.75):
+    return SequenceMatcher(None, a, b).ratio() >= cutoff
+
+
+def _phrase(name):
+    # Ignored names are compared word by word, so "non-HDL" and "non HDL" are the same
+    return " ".join(re.split(r"[\s\-/]+", clean_name(name))).strip()
+
+
+class ReferenceRangeIndex:
+    """Precompiled lookup from free-text test names to reference-table entries.
+
+    Built once at startup. Canonical names, their parenthesised abbreviations
+    and any extra aliases are normalized up front; a trigram index narrows
+    substring and fuzzy matching to a handful of candidates, and results are
+    memoized per name.
+
+    ``ignored`` names are related tests with no reference range of their own
+    ("free T4", "urine glucose"). A name that matches one of them as well as
+    or better than any reference entry matches nothing, as in the lab scanner.
+    """
+
+    def __init__(self, reference_ranges, aliases=None, ignored=(), memo_size=4096):
+        self.ranges = reference_ranges
+        self._canonical = {}
+        self._aliases = {}
+        self._short_keys = []
+        self._grams = defaultdict(set)
+        self._ignored = {_phrase(name) for name in ignored}
+
+        for ref_name in reference_ranges:
+            self._add(self._canonical, clean_name(ref_name), ref_name)
+            for abbreviation in re.findall(r"\(([^)]+)\)", ref_name):
+                self._add(self._aliases, clean_name(abbreviation), ref_name)
+            bare = re.sub(r"\([^)]*\)", "", ref_name)
+            if bare.strip() != ref_name.strip():
+                self._add(self._aliases, clean_name(bare), ref_name)
+
+        for alias, ref_name in (aliases or {}).items():
+            if ref_name in reference_ranges:
+                self._add(self._aliases, clean_name(alias), ref_name)
+
+        self.match = lru_cache(maxsize=memo_size)(self._match)
+
+    @classmethod
+    def build(cls, reference_ranges, test_metadata=None, aliases=None, ignored=()):
+        """Builds the index, taking aliases such as "WBC" or "HbA1c" from the test metadata"""
+        index = cls(reference_ranges, aliases, ignored)
+        aliases = dict(aliases or {})
+        names = set()
+        for group in (test_metadata or {}).values():
+            for tests in group.values():
+                names.update(tests)
+        for name in names:
+            resolved = index._resolve_alias(clean_name(name))
+            if resolved:
+                aliases[name] = resolved
+        return cls(reference_ranges, aliases, ignored)
+
+    def _add(self, table, key, ref_name):
+        if not key or key in self._canonical or key in self._aliases:
+            return
+        table[key] = ref_name
+        if len(key) < 3:
+            self._short_keys.append(key)
+        for gram in _trigrams(key):
+            self._grams[gram].add(key)
+
+    def _ref_for(self, key):
+        return self._canonical.get(key) or self._aliases.get(key)
+
+    def _resolve_alias(self, name):
+        # Only unambiguous names become aliases: "Bilirubin" does, "Cholesterol" doesn't
+        exact = self._ref_for(name)
+        if exact:
+            return exact
+        owners = {ref for key, ref in self._canonical.items() if name in key.split() or name == key}
+        return owners.pop() if len(owners) == 1 else None
+
+    def _candidates(self, name):
+        counts = Counter()
+        for gram in _trigrams(name):
+            for key in self._grams.get(gram, ()):
+                counts[key] += 1
+        return counts
+
+    def _contains(self, name, key):
+        if key in self._canonical:
+            return name in key or key in name
+        # Abbreviations must match whole words, so "alt" doesn't hit "basalt"
+        return key in name.split()
+
+    def _ignored_length(self, name):
+        """Length of the longest ignored name in ``name`` as whole words, or 0"""
+        phrase = f" {_phrase(name)} "
+        return max((len(key) for key in self._ignored if f" {key} " in phrase), default=0)
+
+    def _match(self, name):
+        ignored = self._ignored_length(name)
+        name = clean_name(name)
+        if not name:
+            return None
+
+        exact = self._ref_for(name)
+        if exact and _phrase(name) not in self._ignored:
+            return exact
+
+        counts = self._candidates(name)
+        keys = list(counts) + self._short_keys
+        if len(name) < 3:
+            keys += list(self._canonical)
+
+        # Check if the name is contained in a reference name or vice versa
+        matches = {}
+        for key in keys:
+            if self._contains(name, key):
+                ref_name = self._ref_for(key)
+                matches[ref_name] = max(matches.get(ref_name, 0), len(key))
+        if ignored:
+            # Only a longer reference name than the ignored one can still win, as in the scanner
+            matches = {ref: length for ref, length in matches.items() if length > ignored}
+            return max(matches.items(), key=lambda x: x[1])[0] if matches else None
+        if matches:
+            return max(matches.items(), key=lambda x: x[1])[0]
+
+        # Try fuzzy matching against the keys that share the most trigrams
+        shortlist = [key for key, _ in counts.most_common(16)]
+        for key in get_close_matches(name, shortlist, n=3, cutoff=0.6):
+            if self._tokens_agree(name, key):
+                return self._ref_for(key)
+        return None
+
+    def _tokens_agree(self, name, key):
+        # Every distinguishing word of the key needs a close word in the name, so
+        # "total protein" can't win "total t4" on the shared "total" alone
+        # Hyphens both split words ("hdl-cholesterol") and join them ("t-4")
+        words = name.replace("-", " ").split() + name.replace("-", "").split()
+        return all(
+            any(_similar(token, word) for word in words)
+            for token in key.split() if token not in GENERIC_WORDS
+        )
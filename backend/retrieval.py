@@ -0,0 +1,83 @@
+import math
+import re
+from collections import Counter
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+TOKEN = re.compile(r"\w+")
+
+# Question words that would otherwise pull in passages by sheer frequency
+STOPWORDS = frozenset(
+    "a an and are as at be did do does for from how i in is it me my of on or "
+    "the that this to was were what when which who why with you your".split()
+)
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def split_passages(text, max_words=120, overlap_words=30):
+    """Groups whole sentences into passages of up to ``max_words`` words.
+
+    Consecutive passages share their last ~``overlap_words`` words so an
+    answer that straddles a boundary is still fully inside one passage.
+    """
+    sentences = [s.strip() for s in SENTENCE_BOUNDARY.split(text) if s and s.strip()]
+    passages = []
+    current = []
+    current_words = 0
+
+    for sentence in sentences:
+        words = len(sentence.split())
+        if current and current_words + words > max_words:
+            passages.append(" ".join(current))
+            # Carry the tail of this passage into the next one
+            carried, carried_words = [], 0
+            for previous in reversed(current):
+                carried_words += len(previous.split())
+                if carried_words > overlap_words:
+                    break
+                carried.insert(0, previous)
+            current = carried
+            current_words = sum(len(s.split()) for s in current)
+        current.append(sentence)
+        current_words += words
+
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+class BM25Index:
+    """Okapi BM25 over a report's passages, built once per report"""
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        term_counts = [Counter(tokenize(p)) for p in passages]
+        self._lengths = [sum(counts.values()) for counts in term_counts]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if passages else 0
+
+        # Inverted index, so a query only touches passages that contain its terms
+        self._postings = {}
+        for i, counts in enumerate(term_counts):
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((i, tf))
+        n = len(passages)
+        self._idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def search(self, query, k=3):
+        """Returns up to k (passage_index, score) pairs, best first; empty if nothing matches"""
+        scores = Counter()
+        for term in set(tokenize(query)):
+            if term in STOPWORDS or term not in self._postings:
+                continue
+            idf = self._idf[term]
+            for i, tf in self._postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[i] / (self._avg_length or 1))
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores.most_common(k)
@@ -0,0 +1,149 @@
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class SessionStore:
+    """In-memory sessions with a sliding TTL and an LRU cap.
+
+    Every ``get`` renews the session's expiry; when the store is full the
+    least recently used session is evicted first.
+
+    If a directory is configured each session is also pickled there and the
+    file is the shared copy: its mtime is the last use, so workers sharing the
+    directory renew, expire and delete sessions for each other, and memory
+    only saves re-reading the file.
+    """
+
+    def __init__(self, ttl=1800, max_sessions=256, directory=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.directory = directory
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        state_dir = os.environ.get("STATE_DIR")
+        return cls(
+            ttl=float(os.environ.get("CHAT_SESSION_TTL", "1800")),
+            max_sessions=int(os.environ.get("CHAT_MAX_SESSIONS", "256")),
+            directory=os.path.join(state_dir, "sessions") if state_dir else None,
+        )
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expire(self, now):
+        while self._sessions:
+            session_id, (expires, _) = next(iter(self._sessions.items()))
+            if expires > now and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.pop(session_id)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.pkl")
+
+    def _write(self, session_id, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(session_id))
+
+    def _read(self, session_id):
+        try:
+            with open(self._path(session_id), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _touch(self, session_id):
+        """Renews the session's file; False once it is gone or has expired"""
+        path = self._path(session_id)
+        try:
+            if os.stat(path).st_mtime + self.ttl < time.time():
+                os.remove(path)
+                return False
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def _expire_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                path = os.path.join(self.directory, name)
+                try:
+                    files.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    pass
+        files.sort()
+        cutoff = time.time() - self.ttl
+        excess = len(files) - self.max_sessions
+        for mtime, path in files:
+            if mtime >= cutoff and excess <= 0:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            excess -= 1
+
+    def create(self, value):
+        session_id = uuid.uuid4().hex
+        if self.directory:
+            self._write(session_id, value)
+            self._expire_disk()
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (now + self.ttl, value)
+            self._expire(now)
+        return session_id
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+
+        if self.directory:
+            if not SESSION_ID.fullmatch(session_id) or not self._touch(session_id):
+                with self._lock:
+                    self._sessions.pop(session_id, None)
+                return None
+            if entry is None:
+                # Created by another worker, or dropped from this one's memory
+                value = self._read(session_id)
+                if value is None:
+                    return None
+                entry = (now + self.ttl, value)
+        elif entry is None:
+            return None
+
+        with self._lock:
+            self._sessions[session_id] = (now + self.ttl, entry[1])
+            self._sessions.move_to_end(session_id)
+            self._expire(now)
+        return entry[1]
+
+    def delete(self, session_id):
+        with self._lock:
+            deleted = self._sessions.pop(session_id, None) is not None
+        if self.directory and SESSION_ID.fullmatch(session_id):
+            try:
+                os.remove(self._path(session_id))
+                deleted = True
+            except OSError:
+                pass
+        return deleted
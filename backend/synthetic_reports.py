@@ -0,0 +1,109 @@
+import random
+
+from analytes import ANALYTES
+
+NOTES = [
+    "Specimen received in good condition.",
+    "Patient was fasting for 12 hours prior to collection.",
+    "Results reviewed by the laboratory physician.",
+    "Please correlate clinically with history and examination.",
+    "Values outside the reference range are flagged H or L.",
+    "Repeat testing is recommended if results are unexpected.",
+]
+
+
+def _escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages, font_size=10, leading=13):
+    """A minimal single-font PDF with one text line per entry of each page.
+
+    Written by hand so the benchmark needs no PDF library beyond pdfplumber;
+    text is WinAnsi-encoded, so units such as µL survive extraction.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # The page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+    for lines in pages:
+        text = b" ".join(b"(" + _escape(line).encode("cp1252", "replace") + b") Tj T*" for line in lines)
+        stream = b"BT /F1 %d Tf 50 760 Td %d TL " % (font_size, leading) + text + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+    )
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+def _analyte_line(rng, name, abnormal_rate):
+    info = ANALYTES[name]
+    low, high = info["range"]
+    span = (high - low) or high or 1
+    if rng.random() < abnormal_rate:
+        value = rng.choice([low - rng.uniform(0.05, 0.3) * span, high + rng.uniform(0.05, 0.5) * span])
+    else:
+        value = rng.uniform(low, high)
+    value = max(value, 0.01)
+
+    unit = info["unit"]
+    # Now and then use a spelling or unit the scanner has to normalize
+    alternatives = list(info.get("convert", {}).items())
+    if alternatives and rng.random() < 0.2:
+        unit, factor = rng.choice(alternatives)
+        value, low, high = value / factor, round(low / factor, 2), round(high / factor, 2)
+    elif unit == "K/µL" and rng.random() < 0.3:
+        unit = rng.choice(["K/uL", "x10^3/uL", "10^9/L"])
+
+    aliases = info.get("aliases", ())
+    label = rng.choice(aliases) if aliases and rng.random() < 0.3 else name
+    return f"{label}: {value:.2f} {unit}   ({low} - {high})"
+
+
+def synthetic_report(rng, pages=1, analytes_per_page=10, abnormal_rate=0.2, notes_per_page=3):
+    """Pages of text lines for one lab report, with a realistic mix of tests and prose"""
+    names = list(ANALYTES)
+    report = []
+    for page in range(pages):
+        lines = [
+            "CITY GENERAL HOSPITAL - CLINICAL LABORATORY",
+            f"Patient ID: {rng.randint(100000, 999999)}   Page {page + 1} of {pages}",
+            f"Collected: 2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "Test   Result   Unit   Reference Range",
+        ]
+        tests = [_analyte_line(rng, rng.choice(names), abnormal_rate) for _ in range(analytes_per_page)]
+        notes = [rng.choice(NOTES) for _ in range(notes_per_page)]
+        body = tests + notes
+        rng.shuffle(body)
+        report.append(lines + body)
+    return report
+
+
+def generate_corpus(seed=0, page_counts=(1, 5, 20), densities=(5, 25), reports_per_shape=3,
+                    abnormal_rate=0.2):
+    """Returns [(name, pdf_bytes, pages, analytes_per_page)], deterministic for a seed"""
+    rng = random.Random(seed)
+    corpus = []
+    for pages in page_counts:
+        for density in densities:
+            for i in range(reports_per_shape):
+                report = synthetic_report(rng, pages, density, abnormal_rate)
+                corpus.append((f"p{pages}-d{density}-{i}", make_pdf(report), pages, density))
+    return corpus
@@ -0,0 +1,33 @@
+import pytest
+
+from analytes import readings_to_entities, scanner
+
+# (line, analyte, value in the reference unit); names with digits in them must not be read as values
+SCANNER_CASES = [
+    ("HbA1c (Hemoglobin A1c): 5.55 %", "HbA1c (Hemoglobin A1c)", 5.55),
+    ("Hemoglobin A1c 6.1%", "HbA1c (Hemoglobin A1c)", 6.1),
+    ("T4 (Thyroxine): 8.1 µg/dL", "T4 (Thyroxine)", 8.1),
+    ("T4 total 7.2 ug/dL", "T4 (Thyroxine)", 7.2),
+    ("Glucose, fasting: 95 mg/dL", "Fasting Blood Sugar", 95.0),
+    ("WBC: 7.2 K/uL", "White Blood Cell (WBC)", 7.2),
+]
+
+
+@pytest.mark.parametrize("line, analyte, value", SCANNER_CASES)
+def test_scanner_reads_one_value(line, analyte, value):
+    found = [(reading["analyte"], reading["value"]) for reading in scanner.scan(line)]
+    assert found == [(analyte, value)]
+
+
+def test_scanner_skips_ignored_names():
+    readings = scanner.scan("Free T4: 1.2 ng/dL\nGlucose 95 mg/dL")
+    assert [reading["analyte"] for reading in readings] == ["Glucose"]
+
+
+def test_readings_to_entities_uses_the_ner_format():
+    readings = scanner.scan("Glucose 95 mg/dL")
+    entities = readings_to_entities(readings)
+    assert [(e["entity_group"], e["word"]) for e in entities] == [
+        ("Diagnostic_procedure", "Glucose"), ("Lab_value", "95"), ("Unit", "mg/dL"),
+    ]
+    assert all(e["start"] == readings[0]["start"] and e["end"] == readings[0]["end"] for e in entities)
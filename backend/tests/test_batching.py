@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_outputs_keep_their_callers_order():
+    batcher = MicroBatcher(lambda items: [item * 2 for item in items])
+    assert batcher.run([1, 2, 3]) == [2, 4, 6]
+
+
+def test_concurrent_callers_share_batches():
+    sizes = []
+    lock = threading.Lock()
+
+    def run_batch(items):
+        with lock:
+            sizes.append(len(items))
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=50)
+    words = [f"w{i}" for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda word: batcher.run([word])[0], words))
+
+    assert results == [word.upper() for word in words]
+    assert max(sizes) <= 4
+    assert len(sizes) < len(words)
+
+
+def test_batch_errors_reach_every_caller():
+    def run_batch(items):
+        raise RuntimeError("model failed")
+
+    batcher = MicroBatcher(run_batch)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.run(["a", "b"])
+    # The worker survives a failed batch
+    batcher.run_batch = lambda items: items
+    assert batcher.run(["c"]) == ["c"]
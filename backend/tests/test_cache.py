@@ -0,0 +1,66 @@
+import asyncio
+import os
+import pickle
+import time
+
+from cache import ResultCache, content_digest, make_key
+
+
+def test_keys_are_stable_and_distinct():
+    assert make_key("a", 1) == make_key("a", 1)
+    assert make_key("a", 1) != make_key("a1")
+    assert content_digest(b"pdf") == content_digest(b"pdf")
+
+
+def test_memory_roundtrip_returns_copies():
+    cache = ResultCache()
+    value = {"results": [1, 2]}
+    cache.put("evaluation", "k", value)
+    value["results"].append(3)
+    assert cache.get("evaluation", "k") == {"results": [1, 2]}
+    assert cache.get("evaluation", "missing") is None
+    assert cache.hits["evaluation"] == 1 and cache.misses["evaluation"] == 1
+
+
+def test_memory_is_bounded_least_recently_used_first():
+    cache = ResultCache(max_bytes=400)
+    for key in "abc":
+        cache.put("text", key, "x" * 150)
+    assert cache.size <= 400
+    assert cache.get("text", "a") is None
+    assert cache.get("text", "c") == "x" * 150
+
+
+def test_disk_entries_survive_a_restart(tmp_path):
+    ResultCache(directory=str(tmp_path)).put("entities", "k", [{"word": "Glucose"}])
+    restarted = ResultCache(directory=str(tmp_path))
+    assert restarted.disk_size > 0
+    assert restarted.get("entities", "k") == [{"word": "Glucose"}]
+
+
+def test_async_put_writes_to_disk_in_the_background(tmp_path):
+    cache = ResultCache(directory=str(tmp_path))
+
+    async def run():
+        await cache.aput("text", "k", "report")
+        assert await cache.aget("text", "k") == "report"
+
+    asyncio.run(run())
+    for _ in range(100):
+        if os.path.exists(os.path.join(tmp_path, "text", "k.pkl")):
+            break
+        time.sleep(0.01)
+    assert ResultCache(directory=str(tmp_path)).get("text", "k") == "report"
+
+
+def test_disk_is_pruned_least_recently_used_first(tmp_path):
+    blob_size = len(pickle.dumps("x" * 1000, protocol=pickle.HIGHEST_PROTOCOL))
+    cache = ResultCache(directory=str(tmp_path), max_disk_bytes=blob_size * 3)
+    for i, key in enumerate("abcd"):
+        cache.put("text", key, "x" * 1000)
+        # mtime resolution can be coarse; order the files explicitly
+        os.utime(os.path.join(tmp_path, "text", f"{key}.pkl"), (i, i))
+
+    assert cache.disk_size <= blob_size * 3
+    remaining = sorted(name for name in os.listdir(os.path.join(tmp_path, "text")) if name.endswith(".pkl"))
+    assert "a.pkl" not in remaining and "d.pkl" in remaining
@@ -0,0 +1,50 @@
+from benchmark import StubTokenizer
+from chunking import chunk_text, merge_entities
+
+TEXT = " ".join(f"Analyte{i} {i}.5 mg/dL." for i in range(60))
+
+
+def test_short_text_is_one_window():
+    assert chunk_text("Glucose 95 mg/dL", StubTokenizer(), max_tokens=32) == [(0, "Glucose 95 mg/dL")]
+
+
+def test_blank_text_has_no_windows():
+    assert chunk_text("  \n", StubTokenizer()) == []
+
+
+def test_windows_fit_the_budget_overlap_and_cover_the_text():
+    tokenizer = StubTokenizer()
+    windows = chunk_text(TEXT, tokenizer, max_tokens=40, stride=8)
+    budget = 40 - tokenizer.num_special_tokens_to_add()
+
+    assert len(windows) > 1
+    for start, window in windows:
+        assert TEXT[start:start + len(window)] == window
+        assert len(tokenizer(window)["input_ids"]) <= budget
+    for (start, window), (next_start, _) in zip(windows, windows[1:]):
+        assert start < next_start < start + len(window)
+    assert windows[0][0] == 0
+    last_start, last = windows[-1]
+    assert last_start + len(last) == len(TEXT)
+
+
+def test_windows_are_cut_between_words():
+    windows = chunk_text("2.5 " * 50, StubTokenizer(), max_tokens=20, stride=4)
+    for _, window in windows:
+        assert window.startswith("2.5") and window.endswith("2.5")
+
+
+def test_merge_keeps_the_copy_with_more_context():
+    windows = [(0, "a" * 20), (10, "a" * 20)]
+    near_edge = {"entity_group": "Lab_value", "word": "95", "score": 0.9, "start": 18, "end": 20}
+    centered = {"entity_group": "Lab_value", "word": "95", "score": 0.8, "start": 8, "end": 10}
+    merged = merge_entities(windows, [[near_edge], [centered]])
+    assert merged == [dict(centered, start=18, end=20)]
+
+
+def test_merge_orders_entities_across_windows():
+    windows = [(0, "x" * 10), (5, "x" * 10)]
+    first = {"entity_group": "A", "word": "a", "score": 1.0, "start": 1, "end": 2}
+    second = {"entity_group": "B", "word": "b", "score": 1.0, "start": 8, "end": 9}
+    merged = merge_entities(windows, [[first], [second]])
+    assert [(e["word"], e["start"]) for e in merged] == [("a", 1), ("b", 13)]
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+import pytest
+
+from executor import AnalysisExecutor, ExecutorSaturated, ExecutorTimeout
+
+
+def test_runs_stages_and_releases_the_slot():
+    executor = AnalysisExecutor(max_workers=2, max_queue=0)
+
+    async def run():
+        async with executor.admit() as job:
+            assert executor.in_flight == 1
+            return await job.run(sum, [1, 2, 3])
+
+    assert asyncio.run(run()) == 6
+    assert executor.in_flight == 0
+    executor.shutdown()
+
+
+def test_rejects_beyond_capacity():
+    executor = AnalysisExecutor(max_workers=1, max_queue=1)
+    jobs = [executor.open_job(), executor.open_job()]
+    with pytest.raises(ExecutorSaturated):
+        executor.open_job()
+    for job in jobs:
+        job.close()
+    assert executor.in_flight == 0
+
+
+def test_timed_out_work_keeps_its_slot_until_it_finishes():
+    executor = AnalysisExecutor(max_workers=1, max_queue=0)
+    release = threading.Event()
+
+    async def run():
+        async with executor.admit(timeout=0.05) as job:
+            await job.run(release.wait)
+
+    with pytest.raises(ExecutorTimeout):
+        asyncio.run(run())
+    # The stage is still running on the pool, so the request still counts
+    assert executor.in_flight == 1
+    release.set()
+    executor.shutdown()
+    for _ in range(100):
+        if executor.in_flight == 0:
+            break
+        threading.Event().wait(0.01)
+    assert executor.in_flight == 0
+
+
+def test_closed_job_refuses_more_work():
+    executor = AnalysisExecutor(max_workers=1, max_queue=0)
+    job = executor.open_job()
+    job.close()
+    with pytest.raises(ExecutorTimeout):
+        asyncio.run(job.run(sum, [1]))
+    assert executor.in_flight == 0
+    executor.shutdown()
+
+
+def test_rejects_unknown_kind():
+    with pytest.raises(ValueError):
+        AnalysisExecutor(kind="fiber")
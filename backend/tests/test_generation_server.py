@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from generation_server import GenerationScheduler  # noqa: E402
+
+MAX_NEW_TOKENS = 16
+
+
+@pytest.fixture(scope="module")
+def model():
+    """A tiny randomly initialized Llama that runs on CPU"""
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=128, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=4, eos_token_id=0
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+def reference(model, ids):
+    with torch.no_grad():
+        tokens = model.generate(
+            torch.tensor([ids]), max_new_tokens=MAX_NEW_TOKENS, do_sample=False, pad_token_id=0
+        )[0, len(ids):].tolist()
+    return tokens[:tokens.index(0)] if 0 in tokens else tokens
+
+
+def test_batched_decoding_matches_generate(model):
+    torch.manual_seed(1)
+    inputs = [torch.randint(1, model.config.vocab_size, (5 + 3 * i,)).tolist() for i in range(4)]
+    scheduler = GenerationScheduler(model, max_batch_size=4)
+
+    async def run():
+        return await asyncio.gather(*(
+            scheduler.generate(ids, max_new_tokens=MAX_NEW_TOKENS) for ids in inputs
+        ))
+
+    try:
+        batched = asyncio.run(run())
+    finally:
+        scheduler.close()
+    assert batched == [reference(model, ids) for ids in inputs]
+
+
+def test_sequences_join_a_running_batch(model):
+    scheduler = GenerationScheduler(model, max_batch_size=2)
+    inputs = [[5, 6, 7, 8], [9, 10, 11], [12, 13]]
+
+    async def run():
+        first = asyncio.ensure_future(scheduler.generate(inputs[0], max_new_tokens=MAX_NEW_TOKENS))
+        await asyncio.sleep(0.05)
+        rest = [scheduler.generate(ids, max_new_tokens=MAX_NEW_TOKENS) for ids in inputs[1:]]
+        return await asyncio.gather(first, *rest)
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        scheduler.close()
+    assert results == [reference(model, ids) for ids in inputs]
+
+
+def test_failed_prefill_only_fails_its_own_request(model):
+    vocab = model.config.vocab_size
+    healthy = [[5, 6, 7, 8], [9, 10, 11]]
+    scheduler = GenerationScheduler(model, max_batch_size=4)
+
+    async def run():
+        # One healthy sequence decodes first, so the bad one is admitted into a running batch
+        first = asyncio.ensure_future(scheduler.generate(healthy[0], max_new_tokens=MAX_NEW_TOKENS))
+        await asyncio.sleep(0.1)
+        return await asyncio.wait_for(asyncio.gather(
+            first,
+            scheduler.generate([vocab + 72, 3], max_new_tokens=MAX_NEW_TOKENS),
+            scheduler.generate(healthy[1], max_new_tokens=MAX_NEW_TOKENS),
+            return_exceptions=True
+        ), 30)
+
+    try:
+        first, bad, second = asyncio.run(run())
+    finally:
+        scheduler.close()
+    assert isinstance(bad, Exception)
+    assert first == reference(model, healthy[0])
+    assert second == reference(model, healthy[1])
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from jobs import JobStore, TooManyJobs
+
+
+def test_updates_reach_subscribers_until_the_job_finishes():
+    store = JobStore()
+    job = store.create()
+
+    async def run():
+        async def work():
+            await asyncio.sleep(0.01)
+            store.update(job, status="running", stage="reading", percent=10)
+            store.update(job, status="complete", percent=100, result={"ok": True})
+
+        task = asyncio.create_task(work())
+        snapshots = [snapshot async for snapshot in store.subscribe(job)]
+        await task
+        return snapshots
+
+    snapshots = asyncio.run(run())
+    assert [s["status"] for s in snapshots] == ["queued", "running", "complete"]
+    assert snapshots[-1]["result"] == {"ok": True}
+
+
+def test_unfinished_jobs_are_bounded():
+    store = JobStore(max_active=2)
+    first, _ = store.create(), store.create()
+    with pytest.raises(TooManyJobs):
+        store.create()
+    store.update(first, status="complete")
+    store.create()
+
+
+def test_running_jobs_are_never_pruned():
+    store = JobStore(ttl=0, max_jobs=1, max_active=10)
+    running = store.create()
+    done = store.create()
+    store.update(done, status="error", error="failed")
+    time.sleep(0.01)
+    store.create()
+    assert store.get(running.id) is running
+    assert store.get(done.id) is None
+
+
+def test_workers_sharing_a_directory_see_each_others_jobs(tmp_path):
+    owner, other = JobStore(directory=str(tmp_path)), JobStore(directory=str(tmp_path))
+    job = owner.create()
+    assert other.get(job.id).status == "queued"
+
+    async def follow():
+        async def work():
+            await asyncio.sleep(0.05)
+            owner.update(job, status="running", percent=50)
+            await asyncio.sleep(other.POLL_INTERVAL * 2)
+            owner.update(job, status="complete", percent=100, result={"ok": True})
+
+        task = asyncio.create_task(work())
+        snapshots = [snapshot async for snapshot in other.subscribe(other.get(job.id))]
+        await task
+        return snapshots
+
+    snapshots = asyncio.run(follow())
+    assert [s["status"] for s in snapshots] == ["queued", "running", "complete"]
+    assert other.get(job.id).result == {"ok": True}
+    assert other.get("../../etc/passwd") is None
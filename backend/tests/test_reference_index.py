@@ -0,0 +1,34 @@
+import pytest
+
+from analytes import IGNORED_NAMES, reference_aliases, reference_ranges
+from reference_index import ReferenceRangeIndex
+
+
+@pytest.fixture(scope="module")
+def index():
+    return ReferenceRangeIndex.build(reference_ranges(), None, reference_aliases(), IGNORED_NAMES)
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Glucose", "Glucose"),
+    ("LDL Cholesterol", "LDL Cholesterol"),
+    ("WBC", "White Blood Cell (WBC)"),
+    ("HbA1c", "HbA1c (Hemoglobin A1c)"),
+    ("Hemoglobin A1c", "HbA1c (Hemoglobin A1c)"),
+    ("T4 total", "T4 (Thyroxine)"),
+    ("HDL-Cholesterol", "HDL Cholesterol"),
+    ("Hemoglobn", "Hemoglobin"),
+])
+def test_matches(index, name, expected):
+    assert index.match(name) == expected
+
+
+@pytest.mark.parametrize("name", ["free T4", "Free T4", "Urine glucose", "non HDL cholesterol", "MCHC"])
+def test_ignored_names_match_nothing(index, name):
+    assert index.match(name) is None
+
+
+@pytest.mark.parametrize("name", ["total protein", "xyz", ""])
+def test_unrelated_names_match_nothing(index, name):
+    # "total protein" shares only the generic "total" with "Total Bilirubin" and "Total Cholesterol"
+    assert index.match(name) is None
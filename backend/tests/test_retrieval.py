@@ -0,0 +1,43 @@
+from retrieval import BM25Index, split_passages, tokenize
+
+REPORT = (
+    "Patient reports mild fatigue over the past weeks. "
+    "Lipid panel: LDL cholesterol 160 mg/dL, which is high. HDL cholesterol 45 mg/dL. "
+    "Complete blood count: hemoglobin 13.5 g/dL, within range. "
+    "Thyroid: TSH 2.1 mIU/L, within range."
+)
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize("LDL-Cholesterol: 160 mg/dL") == ["ldl", "cholesterol", "160", "mg", "dl"]
+
+
+def test_passages_hold_whole_sentences_and_overlap():
+    passages = split_passages(REPORT, max_words=20, overlap_words=10)
+    assert len(passages) > 1
+    for passage in passages:
+        assert passage.endswith(".")
+    # Each passage starts with a sentence carried over from the one before
+    for previous, passage in zip(passages, passages[1:]):
+        first_sentence = passage.split(". ")[0]
+        assert first_sentence in previous
+
+
+def test_short_text_is_one_passage():
+    assert split_passages("Glucose 95 mg/dL.") == ["Glucose 95 mg/dL."]
+
+
+def test_search_ranks_the_relevant_passage_first():
+    passages = split_passages(REPORT, max_words=12, overlap_words=0)
+    index = BM25Index(passages)
+    best, score = index.search("What is my TSH?")[0]
+    assert "TSH" in passages[best] and score > 0
+    hits = index.search("hemoglobin", k=5)
+    assert all("hemoglobin" in passages[i] for i, _ in hits)
+
+
+def test_search_ignores_stopwords_and_unknown_terms():
+    index = BM25Index(split_passages(REPORT))
+    assert index.search("what is the") == []
+    assert index.search("ferritin") == []
+    assert BM25Index([]).search("tsh") == []
@@ -0,0 +1,62 @@
+import os
+import time
+
+from sessions import SessionStore
+
+
+def test_get_renews_and_delete_removes():
+    store = SessionStore()
+    session_id = store.create({"passages": 3})
+    assert store.get(session_id) == {"passages": 3}
+    assert store.delete(session_id)
+    assert store.get(session_id) is None
+    assert not store.delete(session_id)
+
+
+def test_sessions_expire_after_the_ttl():
+    store = SessionStore(ttl=0.05)
+    session_id = store.create("report")
+    time.sleep(0.1)
+    assert store.get(session_id) is None
+    assert len(store) == 0
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(max_sessions=2)
+    first, second = store.create(1), store.create(2)
+    store.get(first)
+    third = store.create(3)
+    assert store.get(second) is None
+    assert store.get(first) == 1 and store.get(third) == 3
+
+
+def test_workers_sharing_a_directory_see_each_others_sessions(tmp_path):
+    owner, other = SessionStore(directory=str(tmp_path)), SessionStore(directory=str(tmp_path))
+    session_id = owner.create({"passages": 3})
+    assert other.get(session_id) == {"passages": 3}
+    assert other.delete(session_id)
+    assert owner.get(session_id) is None
+
+
+def test_shared_sessions_expire_by_last_use(tmp_path):
+    owner, other = SessionStore(ttl=60, directory=str(tmp_path)), SessionStore(ttl=60, directory=str(tmp_path))
+    session_id = owner.create("report")
+    path = os.path.join(tmp_path, f"{session_id}.pkl")
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    assert other.get(session_id) is None
+    assert owner.get(session_id) is None
+    assert not os.path.exists(path)
+
+
+def test_shared_directory_is_capped(tmp_path):
+    store = SessionStore(max_sessions=2, directory=str(tmp_path))
+    for i in range(4):
+        session_id = store.create(i)
+        os.utime(os.path.join(tmp_path, f"{session_id}.pkl"), (i, time.time() - 10 + i))
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".pkl")]) <= 2
+
+
+def test_ids_that_are_not_session_ids_are_refused(tmp_path):
+    store = SessionStore(directory=str(tmp_path))
+    assert store.get("../../etc/passwd") is None
+    assert not store.delete("../../etc/passwd")
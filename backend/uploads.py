@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+import pdfplumber
+from starlette.exceptions import HTTPException
+
+from metrics import UPLOAD_BYTES_IN_FLIGHT
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class TooManyPages(Exception):
+    pass
+
+
+class UploadBudgetExceeded(Exception):
+    pass
+
+
+class BodyTooLarge(HTTPException):
+    """Raised from the request body stream; FastAPI lets HTTPExceptions through body parsing"""
+
+    def __init__(self, limit):
+        super().__init__(status_code=413, detail=f"Request exceeds {limit} bytes")
+
+
+class RequestBodyLimit:
+    """ASGI middleware that stops reading a request body once it passes a byte limit.
+
+    ``limit_for(path)`` returns the limit for a route, or None for no limit. A
+    Content-Length over the limit is refused on the first read; a chunked body
+    is counted as it arrives, so neither is spooled to disk past the limit.
+    """
+
+    def __init__(self, app, limit_for):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        length = headers.get(b"content-length", b"")
+        declared = int(length) if length.isdigit() else None
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            if declared is not None and declared > limit:
+                raise BodyTooLarge(limit)
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise BodyTooLarge(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class SpooledUpload:
+    """One received upload, read in place from the file Starlette already spooled.
+
+    Starlette keeps small parts in memory and rolls larger ones over to a temp
+    file. A rolled-over file is memory-mapped rather than copied again; the
+    mapping stays valid after Starlette closes the file. ``source`` is the bytes
+    or that mapping, or always bytes when it has to be pickled to a process pool.
+    """
+
+    def __init__(self, file, portable=False):
+        self.size = 0
+        self.digest = None
+        self._mapped = None
+        self._contents = None
+
+        file.seek(0, os.SEEK_END)
+        self.size = file.tell()
+        file.seek(0)
+        if self.size and _on_disk(file):
+            self._mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            # A mapping can't be pickled, so a process pool gets one copy of the bytes
+            self._contents = self._mapped[:] if portable else self._mapped
+        else:
+            self._contents = file.read()
+        self.digest = hashlib.sha256(self._contents).hexdigest()
+
+    @property
+    def source(self):
+        return self._contents
+
+    def close(self):
+        self._contents = None
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+
+def _on_disk(file):
+    if isinstance(file, tempfile.SpooledTemporaryFile):
+        # fileno() would force an in-memory spool out to disk, so ask whether it rolled over
+        return file._rolled
+    try:
+        file.fileno()
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+class UploadSpool:
+    """Admits uploads within a per-file and a global byte budget.
+
+    ``max_bytes`` caps a single upload; ``in_flight_bytes`` caps the bytes held
+    by all uploads that are still being processed, so a burst of large PDFs is
+    turned away instead of exhausting the worker's memory or disk. With
+    ``portable`` set, sources are plain bytes that can be sent to a process pool.
+    """
+
+    def __init__(self, max_bytes=10 * 2**20, max_pages=200, in_flight_bytes=256 * 2**20, portable=False):
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.in_flight_bytes = in_flight_bytes
+        self.portable = portable
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, portable=False):
+        return cls(
+            max_bytes=int(os.environ.get("UPLOAD_MAX_BYTES", str(10 * 2**20))),
+            max_pages=int(os.environ.get("UPLOAD_MAX_PAGES", "200")),
+            in_flight_bytes=int(os.environ.get("UPLOAD_INFLIGHT_BYTES", str(256 * 2**20))),
+            portable=portable,
+        )
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def _reserve(self, size):
+        with self._lock:
+            if self._in_flight + size > self.in_flight_bytes:
+                raise UploadBudgetExceeded(
+                    f"{self._in_flight} of {self.in_flight_bytes} upload bytes in flight"
+                )
+            self._in_flight += size
+        UPLOAD_BYTES_IN_FLIGHT.inc(size)
+
+    def _release(self, size):
+        with self._lock:
+            self._in_flight -= size
+        UPLOAD_BYTES_IN_FLIGHT.dec(size)
+
+    def _check_size(self, size):
+        if size > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+
+    @asynccontextmanager
+    async def receive(self, upload):
+        """Admits an UploadFile as a SpooledUpload, released when the block exits"""
+        size = upload.size
+        if size is None:
+            upload.file.seek(0, os.SEEK_END)
+            size = upload.file.tell()
+        self._check_size(size)
+        self._reserve(size)
+        spooled = None
+        try:
+            # Hashing a large upload would otherwise stall the event loop
+            spooled = await asyncio.to_thread(SpooledUpload, upload.file, self.portable)
+            yield spooled
+        finally:
+            if spooled is not None:
+                spooled.close()
+            self._release(size)
+
+
+@contextmanager
+def open_pdf(source, max_pages=None):
+    """Opens PDF bytes or a mapping as they are, or memory-maps a PDF file, without copying it"""
+    mapped = None
+    if isinstance(source, (bytes, bytearray)):
+        stream = io.BytesIO(source)
+    elif isinstance(source, mmap.mmap):
+        stream = source
+    else:
+        with open(source, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        stream = mapped
+    try:
+        with pdfplumber.open(stream) as pdf:
+            if max_pages and len(pdf.pages) > max_pages:
+                raise TooManyPages(f"PDF has {len(pdf.pages)} pages, the limit is {max_pages}")
+            yield pdf
+    finally:
+        if mapped is not None:
+            mapped.close()
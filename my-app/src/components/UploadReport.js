@@ -8,12 +8,14 @@ function UploadReport({ onUpload }) {
   const [error, setError] = useState(null);
   const [question, setQuestion] = useState('');
   const [chatResponse, setChatResponse] = useState(null);
+  const [chatSessionId, setChatSessionId] = useState(null);
   const [progress, setProgress] = useState({ status: '', percent: 0 });
 
   const handleFileChange = (event) => {
     setSelectedFile(event.target.files[0]);
     setError(null);
     setAnalysis(null);
+    setChatSessionId(null);
   };
 
   const handleUpload = async () => {
@@ -82,17 +84,38 @@ function UploadReport({ onUpload }) {
     }
   };
 
+  const createChatSession = async () => {
+    // The report is sent once; later questions only carry the session id
+    const response = await axios.post('http://localhost:8000/api/chat-sessions', {
+      text: analysis.text
+    });
+    if (!response.data.success) {
+      throw new Error(response.data.error);
+    }
+    setChatSessionId(response.data.session_id);
+    return response.data.session_id;
+  };
+
+  const askQuestion = (sessionId) =>
+    axios.post(`http://localhost:8000/api/chat-sessions/${sessionId}/questions`, {
+      questions: [question]
+    });
+
   const handleQuestion = async () => {
     if (!question || !analysis) return;
 
     try {
-      const response = await axios.post('http://localhost:8000/api/chat-with-report', {
-        text: analysis.text,
-        question: question
-      });
+      let response;
+      try {
+        response = await askQuestion(chatSessionId || await createChatSession());
+      } catch (error) {
+        // Sessions expire after a while; register the report again and retry once
+        if (!error.response || error.response.status !== 404) throw error;
+        response = await askQuestion(await createChatSession());
+      }
 
       if (response.data.success) {
-        setChatResponse(response.data.response);
+        setChatResponse(response.data.responses[0]);
       } else {
         setError('Failed to process question');
       }
@@ -3,12 +3,32 @@ const multer = require('multer');
 const path = require('path');
 
 const app = express();
-const upload = multer({ dest: 'uploads/' });
+
+// Same limits as the Python backend (UPLOAD_MAX_BYTES); one PDF per request
+const MAX_UPLOAD_BYTES = parseInt(process.env.UPLOAD_MAX_BYTES || String(10 * 1024 * 1024), 10);
+
+const upload = multer({
+  dest: 'uploads/',
+  limits: { fileSize: MAX_UPLOAD_BYTES, files: 1, fields: 10 },
+  fileFilter: (req, file, cb) => {
+    const isPdf = file.mimetype === 'application/pdf' && path.extname(file.originalname).toLowerCase() === '.pdf';
+    cb(isPdf ? null : new multer.MulterError('LIMIT_UNEXPECTED_FILE', file.fieldname), isPdf);
+  }
+});
 
 app.post('/api/upload', upload.single('report'), (req, res) => {
   res.send({ message: 'File uploaded successfully', file: req.file });
 });
 
+app.use((err, req, res, next) => {
+  if (err instanceof multer.MulterError) {
+    const status = err.code === 'LIMIT_FILE_SIZE' ? 413 : 400;
+    const error = err.code === 'LIMIT_UNEXPECTED_FILE' ? 'Only a single PDF file is accepted' : err.message;
+    return res.status(status).send({ error });
+  }
+  next(err);
+});
+
 app.listen(5000, () => {
   console.log('Server is running on port 5000');
-}); 
\ No newline at end of file
+});